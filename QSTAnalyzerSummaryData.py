@@ -1,171 +1,225 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
 import io
-import math
+import hashlib
+import cProfile
+import datetime
+import os
+import pstats
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from qst_cache import SheetCache
+from qst_core import (
+    LOG_TRANSFORMED_PARAMETERS, PARAMETERS, REQUIRED_SUMMARY_COLUMNS,
+    AnalysisCache
+)
+from qst_ingest import (
+    DEFAULT_ALIASES_PATH, default_aliases, normalize_modalities, read_tables, standardize_summary, supported_extensions
+)
+from qst_jobs import QUEUED, RUNNING, UploadJob
+from qst_metrics import finish_run, increment, start_run, timed, timer
+from qst_report import chart_series, comparison_png, is_log_transformed, render_html, render_pdf, result_table
+from qst_norms import DEFAULT_NORM_SET, available_norm_sets, load_norm_set
+from qst_sessions import SESSION_MEMORY_BUDGET, SessionRegistry, SessionUploads, SessionUsage, deep_size, process_memory
+from qst_store import DEFAULT_STORE_PATH, ResultsStore
+from qst_templates import (
+    DEFAULT_TEMPLATES_PATH, apply_area_mapping, delete_template, load_templates, match_template, save_template,
+    suggest_areas
+)
+from qst_trials import compare_with_summary, stream_trial_stats
 
 # Set page configuration
 st.set_page_config(page_title="QST Thermal Parameters Analyzer", layout="wide")
 
-# Define which parameters are log-transformed
-LOG_TRANSFORMED_PARAMETERS = ["CDT", "WDT"]  # CDT and WDT are log-transformed according to the grey shading
-
-def load_reference_values():
-    reference_values = {
-        'female': {
-            '20-30': {}, 
-            '30-40': {}, 
-            '40-50': {}, 
-            '50-60': {}, 
-            '>60': {}
-        },
-        'male': {
-            '20-30': {}, 
-            '30-40': {}, 
-            '40-50': {}, 
-            '50-60': {}, 
-            '>60': {}
-        }
-    }
-    
-    # Female reference values
-    # CDT (Cold Detection Threshold) - Log-transformed in greyed areas
-    reference_values['female']['20-30']['CDT'] = {'face': (-0.030, 0.199), 'hand': (0.046, 0.232), 'feet': (0.278, 0.257)}
-    reference_values['female']['30-40']['CDT'] = {'face': (-0.035, 0.167), 'hand': (0.078, 0.209), 'feet': (0.348, 0.258)}
-    reference_values['female']['40-50']['CDT'] = {'face': (-0.004, 0.191), 'hand': (0.145, 0.217), 'feet': (0.417, 0.256)}
-    reference_values['female']['50-60']['CDT'] = {'face': (0.022, 0.218), 'hand': (0.158, 0.229), 'feet': (0.404, 0.279)}
-    reference_values['female']['>60']['CDT'] = {'face': (0.016, 0.240), 'hand': (0.187, 0.271), 'feet': (0.377, 0.298)}
-
-    # WDT (Warm Detection Threshold) - Log-transformed in greyed areas
-    reference_values['female']['20-30']['WDT'] = {'face': (0.129, 0.187), 'hand': (0.187, 0.193), 'feet': (0.565, 0.175)}
-    reference_values['female']['30-40']['WDT'] = {'face': (0.118, 0.174), 'hand': (0.210, 0.206), 'feet': (0.598, 0.203)}
-    reference_values['female']['40-50']['WDT'] = {'face': (0.153, 0.213), 'hand': (0.295, 0.217), 'feet': (0.650, 0.214)}
-    reference_values['female']['50-60']['WDT'] = {'face': (0.178, 0.224), 'hand': (0.346, 0.204), 'feet': (0.664, 0.215)}
-    reference_values['female']['>60']['WDT'] = {'face': (0.176, 0.215), 'hand': (0.368, 0.211), 'feet': (0.657, 0.222)}
-
-    # CPT (Cold Pain Threshold) - Not log-transformed
-    reference_values['female']['20-30']['CPT'] = {'face': (18.00, 7.74), 'hand': (15.61, 7.15), 'feet': (14.11, 8.49)}
-    reference_values['female']['30-40']['CPT'] = {'face': (15.26, 8.91), 'hand': (13.88, 8.55), 'feet': (13.36, 9.08)}
-    reference_values['female']['40-50']['CPT'] = {'face': (14.92, 9.92), 'hand': (12.17, 8.71), 'feet': (12.16, 9.76)}
-    reference_values['female']['50-60']['CPT'] = {'face': (13.34, 10.41), 'hand': (10.74, 7.92), 'feet': (11.45, 9.64)}
-    reference_values['female']['>60']['CPT'] = {'face': (6.75, 8.02), 'hand': (8.58, 8.09), 'feet': (9.12, 8.42)}
-
-    # HPT (Heat Pain Threshold) - Not log-transformed
-    reference_values['female']['20-30']['HPT'] = {'face': (41.61, 4.27), 'hand': (42.68, 3.24), 'feet': (43.69, 2.80)}
-    reference_values['female']['30-40']['HPT'] = {'face': (42.06, 4.22), 'hand': (42.79, 3.65), 'feet': (43.96, 3.01)}
-    reference_values['female']['40-50']['HPT'] = {'face': (42.23, 3.90), 'hand': (43.49, 3.63), 'feet': (44.73, 2.78)}
-    reference_values['female']['50-60']['HPT'] = {'face': (43.04, 3.73), 'hand': (44.73, 2.72), 'feet': (45.71, 2.12)}
-    reference_values['female']['>60']['HPT'] = {'face': (44.29, 3.26), 'hand': (45.30, 2.24), 'feet': (45.99, 1.99)}
-
-    # Male reference values
-    # CDT (Cold Detection Threshold) - Log-transformed in greyed areas
-    reference_values['male']['20-30']['CDT'] = {'face': (-0.062, 0.228), 'hand': (0.035, 0.223), 'feet': (0.380, 0.249)}
-    reference_values['male']['30-40']['CDT'] = {'face': (-0.088, 0.214), 'hand': (0.024, 0.228), 'feet': (0.406, 0.247)}
-    reference_values['male']['40-50']['CDT'] = {'face': (0.008, 0.202), 'hand': (0.090, 0.270), 'feet': (0.473, 0.319)}
-    reference_values['male']['50-60']['CDT'] = {'face': (0.015, 0.224), 'hand': (0.126, 0.261), 'feet': (0.557, 0.290)}
-    reference_values['male']['>60']['CDT'] = {'face': (-0.001, 0.236), 'hand': (0.209, 0.234), 'feet': (0.616, 0.266)}
-
-    # WDT (Warm Detection Threshold) - Log-transformed in greyed areas
-    reference_values['male']['20-30']['WDT'] = {'face': (0.104, 0.228), 'hand': (0.210, 0.206), 'feet': (0.645, 0.217)}
-    reference_values['male']['30-40']['WDT'] = {'face': (0.072, 0.206), 'hand': (0.273, 0.237), 'feet': (0.733, 0.218)}
-    reference_values['male']['40-50']['WDT'] = {'face': (0.160, 0.214), 'hand': (0.294, 0.239), 'feet': (0.784, 0.211)}
-    reference_values['male']['50-60']['WDT'] = {'face': (0.168, 0.240), 'hand': (0.289, 0.198), 'feet': (0.785, 0.235)}
-    reference_values['male']['>60']['WDT'] = {'face': (0.135, 0.254), 'hand': (0.393, 0.262), 'feet': (0.803, 0.237)}
-
-    # CPT (Cold Pain Threshold) - Not log-transformed
-    reference_values['male']['20-30']['CPT'] = {'face': (13.69, 9.54), 'hand': (11.24, 8.15), 'feet': (10.65, 7.90)}
-    reference_values['male']['30-40']['CPT'] = {'face': (15.18, 10.29), 'hand': (12.01, 9.23), 'feet': (11.10, 8.94)}
-    reference_values['male']['40-50']['CPT'] = {'face': (13.39, 10.69), 'hand': (10.49, 9.56), 'feet': (8.77, 8.62)}
-    reference_values['male']['50-60']['CPT'] = {'face': (8.71, 8.50), 'hand': (6.51, 6.60), 'feet': (8.85, 9.01)}
-    reference_values['male']['>60']['CPT'] = {'face': (9.89, 8.58), 'hand': (6.54, 6.98), 'feet': (11.19, 11.00)}
-
-    # HPT (Heat Pain Threshold) - Not log-transformed
-    reference_values['male']['20-30']['HPT'] = {'face': (43.98, 3.50), 'hand': (44.28, 2.86), 'feet': (45.12, 2.40)}
-    reference_values['male']['30-40']['HPT'] = {'face': (43.87, 3.73), 'hand': (44.99, 2.86), 'feet': (45.74, 2.56)}
-    reference_values['male']['40-50']['HPT'] = {'face': (44.27, 3.98), 'hand': (44.81, 2.88), 'feet': (46.36, 2.32)}
-    reference_values['male']['50-60']['HPT'] = {'face': (45.27, 3.56), 'hand': (45.62, 3.07), 'feet': (46.89, 1.97)}
-    reference_values['male']['>60']['HPT'] = {'face': (45.71, 2.67), 'hand': (46.95, 2.53), 'feet': (47.74, 1.55)}
-
-    return reference_values
-
-def is_within_normal_range(value, reference_mean, reference_sd, is_log_transformed=False):
-    if is_log_transformed:
-        try:
-            # Convert patient value to log10 if it's positive
-            if value <= 0:
-                st.warning(f"Can't log-transform value {value} (must be positive)")
-                return False, 0, 0
-                
-            log_value = math.log10(value)
-            
-            lower_limit = reference_mean - 2 * reference_sd
-            upper_limit = reference_mean + 2 * reference_sd
-            
-            return lower_limit <= log_value <= upper_limit, lower_limit, upper_limit
-        except Exception as e:
-            st.error(f"Error in log-transformed comparison: {e}")
-            return False, 0, 0
-    else:
-        lower_limit = reference_mean - 2 * reference_sd
-        upper_limit = reference_mean + 2 * reference_sd
-        return lower_limit <= value <= upper_limit, lower_limit, upper_limit
+# Number of uploaded workbooks kept in the parsed-sheet cache
+EXCEL_CACHE_MAX_ENTRIES = 32
 
-def transform_from_log(log_value):
-    try:
-        return 10 ** log_value
-    except Exception as e:
-        st.error(f"Error transforming from log space: {e}")
-        return 0
-
-def get_age_group(age):
-    if 20 <= age < 30:
-        return '20-30'
-    elif 30 <= age < 40:
-        return '30-40'
-    elif 40 <= age < 50:
-        return '40-50'
-    elif 50 <= age < 60:
-        return '50-60'
-    elif age >= 60:
-        return '>60'
+# Number of rendered comparison charts kept in memory
+CHART_CACHE_MAX_ENTRIES = 256
+
+# Workbooks processed at once in the background, across all sessions
+UPLOAD_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+# Seconds between refreshes of the background progress table
+PROGRESS_REFRESH_SECONDS = 1
+
+# Functions listed in the profile summary shown in the diagnostics panel
+PROFILE_TOP_FUNCTIONS = 30
+
+def show_diagnostics(diagnostics):
+    for diagnostic in diagnostics:
+        if diagnostic.level == 'error':
+            st.error(diagnostic.message)
+        else:
+            st.warning(diagnostic.message)
+
+@st.cache_resource
+def get_sheet_cache():
+    return SheetCache()
+
+@st.cache_resource
+def get_results_store():
+    return ResultsStore()
+
+# Threads rather than processes: Streamlit runs the app as __main__, so spawned
+# workers would re-run it, and forking the multithreaded server is unsafe
+@st.cache_resource
+def get_worker_pool():
+    return ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='qst-upload')
+
+# Shared by all sessions, so demographic changes re-score only what changed
+@st.cache_resource
+def get_analysis_cache():
+    return AnalysisCache()
+
+@st.cache_resource
+def get_session_registry():
+    return SessionRegistry()
+
+def get_session_uploads():
+    if 'uploads' not in st.session_state:
+        st.session_state['uploads'] = SessionUploads()
+    return st.session_state['uploads']
+
+def current_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+def is_active_session(session_id):
+    return not Runtime.exists() or Runtime.instance().is_active_session(session_id)
+
+def session_usage(uploads):
+    """Memory held by this session: its uploaded files, and everything else in its session state."""
+    state = {k: v for k, v in st.session_state.to_dict().items() if k != 'uploads'}
+    return SessionUsage(
+        current_session_id(), len(uploads), uploads.nbytes, deep_size(state), uploads.budget, time.time()
+    )
+
+def file_content_hash(uploaded_file):
+    # Stored uploads hash their bytes once, when they are taken from the uploader
+    content_hash = getattr(uploaded_file, 'content_hash', None)
+    return content_hash or hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+def is_excel(name):
+    return name.lower().endswith(('.xlsx', '.xls'))
+
+# The workbook bytes are excluded from Streamlit's argument hashing (leading
+# underscore); the content hash identifies the upload instead. Parsed tables
+# are cached as resources: one copy shared read-only by every session and
+# rerun, rather than a fresh copy per call. Callers must not modify them.
+@st.cache_resource(max_entries=EXCEL_CACHE_MAX_ENTRIES, show_spinner=False)
+def _read_delimited(content_hash, name, _data):
+    return read_tables(io.BytesIO(_data), name) or {}
+
+@st.cache_data(max_entries=EXCEL_CACHE_MAX_ENTRIES, show_spinner=False)
+def _read_sheet_names(content_hash, name, _data):
+    if not is_excel(name):
+        return list(_read_delimited(content_hash, name, _data))
+    
+    sheet_names = get_sheet_cache().sheet_names(content_hash)
+    if sheet_names is None:
+        sheet_names = pd.ExcelFile(io.BytesIO(_data)).sheet_names
+    return sheet_names
+
+@st.cache_resource(max_entries=EXCEL_CACHE_MAX_ENTRIES, show_spinner="Reading sheet...")
+def _read_summary_sheet(content_hash, name, sheet_name, _data):
+    if not is_excel(name):
+        df = _read_delimited(content_hash, name, _data)[sheet_name]
     else:
-        return None  # Age is below reference ranges
+        sheet_cache = get_sheet_cache()
+        
+        # The on-disk cache is keyed by the same content hash and holds whole sheets
+        df = sheet_cache.load_sheet(content_hash, sheet_name)
+        if df is None:
+            increment('excel_sheet_parse')
+            xls = pd.ExcelFile(io.BytesIO(_data))
+            df = pd.read_excel(xls, sheet_name)
+            sheet_cache.store_sheet(content_hash, xls.sheet_names, sheet_name, df)
+        else:
+            increment('sheet_disk_cache_hit')
+    
+    # Exports from other devices and languages are renamed to the SUMMARY_COLUMNS.
+    # Only those columns are kept, unless the layout isn't recognized, in which
+    # case the full sheet is kept so the user can see what is there
+    _, summary = standardize_summary(df)
+    return df if summary is None else summary
 
-def parse_excel_file(uploaded_file):
+@timed('workbook_load')
+def list_excel_sheets(uploaded_file):
     try:
-        if uploaded_file.name.endswith('.xlsx') or uploaded_file.name.endswith('.xls'):
-            xls = pd.ExcelFile(uploaded_file)
-            
-            sheet_names = xls.sheet_names
-            
-            data = {}
-            
-            for sheet_name in sheet_names:
-                data[sheet_name] = pd.read_excel(xls, sheet_name)
-            
-            return data
+        if uploaded_file.name.lower().endswith(tuple(supported_extensions())):
+            return _read_sheet_names(file_content_hash(uploaded_file), uploaded_file.name, uploaded_file.getvalue())
         else:
-            st.error("Please upload an Excel file (.xlsx or .xls)")
+            st.error(f"Please upload an Excel workbook or CSV/TSV export ({', '.join(supported_extensions())})")
             return None
     except Exception as e:
-        st.error(f"Error reading Excel file: {e}")
+        st.error(f"Error reading {uploaded_file.name}: {e}")
         return None
 
-def normalize_modality(modality):
-    modality_lower = modality.lower()
-    
-    if "cold detection" in modality_lower:
-        return "CDT"
-    elif "warm detection" in modality_lower:
-        return "WDT"
-    elif "cold pain" in modality_lower:
-        return "CPT"
-    elif "hot pain" in modality_lower or "heat pain" in modality_lower:
-        return "HPT"
+@timed('sheet_read')
+def read_summary_sheet(uploaded_file, sheet_name):
+    try:
+        return _read_summary_sheet(
+            file_content_hash(uploaded_file), uploaded_file.name, sheet_name, uploaded_file.getvalue()
+        )
+    except Exception as e:
+        st.error(f"Error reading sheet {sheet_name}: {e}")
+        return None
+
+@st.cache_resource(max_entries=EXCEL_CACHE_MAX_ENTRIES, show_spinner="Streaming raw trial sheets...")
+def _stream_trial_stats(content_hash, _data):
+    return stream_trial_stats(io.BytesIO(_data))
+
+def validate_trial_sheets(uploaded_file, summary_df):
+    try:
+        trial_stats = _stream_trial_stats(file_content_hash(uploaded_file), uploaded_file.getvalue())
+    except Exception as e:
+        st.error(f"Error reading raw trial sheets: {e}")
+        return
+    
+    if trial_stats.empty:
+        st.info("No raw trial sheets (with Sequence, Modality and a trial value column) were found in this workbook.")
+        return
+    
+    comparison = compare_with_summary(trial_stats, summary_df)
+    mismatches = int((~comparison['matches']).sum())
+    
+    if mismatches:
+        st.warning(f"{mismatches} of {len(comparison)} summary rows disagree with the raw trials.")
     else:
-        return modality  # Return original if not recognized
+        st.success("Summary sheet Avg/STD match the raw trials.")
+    
+    st.dataframe(comparison)
 
+def teach_modality_aliases(modality_mapping):
+    """Let the user name the parameter of labels the patterns don't recognize; remembered for later uploads."""
+    unrecognized = modality_mapping.loc[
+        ~modality_mapping['Normalized Modality'].isin(PARAMETERS), 'Original Modality'
+    ]
+    if unrecognized.empty:
+        return
+    
+    with st.expander(f"Unrecognized test labels ({len(unrecognized)})"):
+        st.write("Tests with these labels are ignored. Choose a parameter to recognize a label from now on.")
+        with st.form("modality_aliases"):
+            choices = {
+                label: st.selectbox(f"'{label}'", ["Ignore", *PARAMETERS], key=f"alias_{label}")
+                for label in unrecognized
+            }
+            if st.form_submit_button("Remember labels"):
+                taught = {label: param for label, param in choices.items() if param != "Ignore"}
+                for label, param in taught.items():
+                    default_aliases().learn(label, param)
+                if taught:
+                    st.rerun()
+
+@timed('extraction')
 def extract_qst_parameters(summary_df):
     """
     Extract QST parameters from summary sheet data.
@@ -177,16 +231,15 @@ def extract_qst_parameters(summary_df):
     Dictionary with extracted QST parameters
     """
     try:
-        expected_columns = ['Sequence', 'Modality', 'Trials', 'Avg', 'Var', 'STD']
-        required_columns = ['Sequence', 'Modality', 'Avg']
-        
-        missing_columns = [col for col in required_columns if col not in summary_df.columns]
+        missing_columns = [col for col in REQUIRED_SUMMARY_COLUMNS if col not in summary_df.columns]
         if missing_columns:
             st.error(f"Missing essential columns in summary sheet: {', '.join(missing_columns)}")
             st.write("Available columns:", ', '.join(summary_df.columns))
             return None
         
-        summary_df['Normalized_Modality'] = summary_df['Modality'].apply(normalize_modality)
+        with timer('modality_normalization'):
+            # The summary sheet is shared between sessions, so the column goes on a copy
+            summary_df = summary_df.assign(Normalized_Modality=normalize_modalities(summary_df['Modality']))
         
         st.subheader("Map Body Areas")
         st.write("""
@@ -196,52 +249,96 @@ def extract_qst_parameters(summary_df):
         
         modalities = summary_df['Normalized_Modality'].unique()
         
-        qst_modalities = [m for m in modalities if m in ['CDT', 'WDT', 'CPT', 'HPT']]
+        qst_modalities = [m for m in modalities if m in PARAMETERS]
+        
+        modality_mapping = summary_df[['Modality', 'Normalized_Modality']].drop_duplicates('Modality').set_axis(
+            ['Original Modality', 'Normalized Modality'], axis=1
+        )
+        teach_modality_aliases(modality_mapping)
         
         if not qst_modalities:
             st.error("Could not find or normalize modalities to CDT, WDT, CPT, or HPT in the data.")
-            st.write("Available modalities:", ', '.join(modalities))
+            st.write("Available modalities:", ', '.join(map(str, modalities)))
             return None
         
         st.write("### Detected Test Types:")
-        modality_mapping = pd.DataFrame({
-            'Original Modality': summary_df['Modality'].unique(),
-            'Normalized Modality': [normalize_modality(m) for m in summary_df['Modality'].unique()]
-        })
         st.table(modality_mapping)
         
-        modality_area_map = {}
+        templates = load_templates()
+        template_name, modality_area_map = match_template(templates, summary_df)
+        suggested_areas = {}
+        editing = False
         
-        for modality in qst_modalities:
-            st.write(f"### {modality} Tests")
-            
-            if modality in LOG_TRANSFORMED_PARAMETERS:
-                st.info(f"Note: {modality} is log10-transformed in the normative reference data.")
-                
-            modality_rows = summary_df[summary_df['Normalized_Modality'] == modality]
-            
-            for _, row in modality_rows.iterrows():
-                sequence = row['Sequence']
-                
-                area = st.selectbox(
-                    f"Body area for {modality} test (Sequence {sequence}, Original: '{row['Modality']}', Avg: {row['Avg']}):", 
-                    ["Select area...", "Face", "Hand", "Feet"],
-                    key=f"{modality}_{sequence}"
+        if template_name:
+            st.success(f"Applied saved mapping template '{template_name}'.")
+            # Editing puts the template's areas back into the form, to change and save again
+            editing = st.checkbox("Change this mapping")
+            if editing:
+                suggested_areas, modality_area_map = modality_area_map, {}
+                if st.button(f"Delete template '{template_name}'"):
+                    try:
+                        delete_template(template_name)
+                        st.rerun()
+                    except OSError as e:
+                        st.error(f"Error deleting mapping template: {e}")
+        else:
+            # Templates of other protocols only pre-fill the form: they may use the
+            # same Sequence numbers for other body areas
+            suggested_areas = suggest_areas(templates, summary_df)
+            if suggested_areas:
+                st.info(
+                    f"Pre-filled {len(suggested_areas)} tests from saved templates of other protocols. "
+                    "Check them before applying the mapping."
                 )
-                
-                if area != "Select area...":
-                    modality_area_map[(modality, sequence)] = area.lower()
         
-        parameters = {}
-        for (modality, sequence), area in modality_area_map.items():
-            row = summary_df[(summary_df['Normalized_Modality'] == modality) & (summary_df['Sequence'] == sequence)]
-            
-            if not row.empty:
-                value = row['Avg'].iloc[0]
-                
-                param_name = f"{modality}_{area}"
+        if modality_area_map:
+            st.table(pd.DataFrame(
+                [{"Modality": m, "Sequence": s, "Body Area": area.capitalize()} for (m, s), area in modality_area_map.items()]
+            ))
+        
+        unmapped_rows = summary_df[[
+            (m, s) not in modality_area_map and m in qst_modalities
+            for m, s in zip(summary_df['Normalized_Modality'], summary_df['Sequence'])
+        ]]
+        
+        # Rows not covered by the protocol's template are mapped by hand; the form submits them all in one rerun
+        if not unmapped_rows.empty:
+            with st.form("area_mapping"):
+                for modality in qst_modalities:
+                    modality_rows = unmapped_rows[unmapped_rows['Normalized_Modality'] == modality]
+                    if modality_rows.empty:
+                        continue
+                    
+                    st.write(f"### {modality} Tests")
+                    
+                    if modality in LOG_TRANSFORMED_PARAMETERS:
+                        st.info(f"Note: {modality} is log10-transformed in the normative reference data.")
+                    
+                    for sequence, original, avg in zip(modality_rows['Sequence'], modality_rows['Modality'], modality_rows['Avg']):
+                        options = ["Select area...", "Face", "Hand", "Feet"]
+                        suggested = str(suggested_areas.get((modality, sequence), '')).capitalize()
+                        area = st.selectbox(
+                            f"Body area for {modality} test (Sequence {sequence}, Original: '{original}', Avg: {avg}):", 
+                            options, index=options.index(suggested) if suggested in options else 0,
+                            key=f"{modality}_{sequence}"
+                        )
+                        
+                        if area != "Select area...":
+                            modality_area_map[(modality, sequence)] = area.lower()
                 
-                parameters[param_name] = value
+                st.form_submit_button("Apply mapping")
+        
+        if modality_area_map and (editing or not template_name):
+            with st.expander("Save this mapping as a template", expanded=editing):
+                name = st.text_input("Template name:", value=template_name or "")
+                if st.button("Save template") and name:
+                    try:
+                        save_template(name, summary_df, modality_area_map)
+                        st.success(f"Saved mapping template '{name}'.")
+                    except OSError as e:
+                        st.error(f"Error saving mapping template: {e}")
+        
+        parameters = apply_area_mapping(summary_df, modality_area_map)
         
         return parameters
     
@@ -250,80 +347,33 @@ def extract_qst_parameters(summary_df):
         st.exception(e)
         return None
 
-def analyze_qst_parameters(params, gender, age, reference_values):
-    age_group = get_age_group(age)
-    if not age_group:
-        st.error("Age must be at least 20 years.")
-        return None
-    
-    results = {}
+# Charts are cached by their content, so reruns with unchanged results reuse the
+# rendered image instead of drawing it again
+@st.cache_data(max_entries=CHART_CACHE_MAX_ENTRIES, show_spinner=False)
+def render_comparison_png(param, areas, patient_values, ref_means, lower_limits, upper_limits):
+    with timer('figure_render'):
+        return comparison_png(param, areas, patient_values, ref_means, lower_limits, upper_limits)
+
+@st.cache_data(max_entries=CHART_CACHE_MAX_ENTRIES, show_spinner=False)
+def comparison_figure_spec(param, areas, patient_values, ref_means, lower_limits, upper_limits):
+    """Plotly figure spec of the comparison chart, drawn client-side by the browser."""
+    import plotly.graph_objects as go
     
-    for param_area, value in params.items():
-        parts = param_area.split('_')
-        if len(parts) != 2:
-            st.warning(f"Invalid parameter name format: {param_area}")
-            continue
-            
-        param, area = parts
-        
-        if param not in ['CDT', 'WDT', 'CPT', 'HPT']:
-            st.warning(f"Unknown parameter: {param}")
-            continue
-            
-        if area not in ['face', 'hand', 'feet']:
-            st.warning(f"Unknown body area: {area}")
-            continue
-        
-        if param not in reference_values[gender][age_group]:
-            st.warning(f"No reference values for {param} in {gender}, age group {age_group}")
-            continue
-            
-        if area not in reference_values[gender][age_group][param]:
-            st.warning(f"No reference values for {param} in {area}, {gender}, age group {age_group}")
-            continue
-        
-        ref_mean, ref_sd = reference_values[gender][age_group][param][area]
-        
-        is_log_transformed = param in LOG_TRANSFORMED_PARAMETERS
-        
-        is_normal, lower_limit, upper_limit = is_within_normal_range(
-            value, ref_mean, ref_sd, is_log_transformed=is_log_transformed
+    fig = go.Figure([
+        go.Bar(name='Patient Value', x=list(areas), y=list(patient_values), marker_color='lightcoral'),
+        go.Bar(
+            name='Reference Mean', x=list(areas), y=list(ref_means), marker_color='lightblue',
+            error_y=dict(
+                type='data', symmetric=False, color='blue', thickness=2,
+                array=[upper - mean for upper, mean in zip(upper_limits, ref_means)],
+                arrayminus=[mean - lower for lower, mean in zip(lower_limits, ref_means)]
+            )
         )
-        
-        if param not in results:
-            results[param] = {}
-            
-        if is_log_transformed:
-            display_lower = transform_from_log(lower_limit)
-            display_upper = transform_from_log(upper_limit)
-            display_mean = transform_from_log(ref_mean)
-            
-            results[param][area] = {
-                'patient_value': value,
-                'reference_mean': ref_mean,
-                'reference_sd': ref_sd,
-                'lower_limit': lower_limit,
-                'upper_limit': upper_limit,
-                'display_lower': display_lower,
-                'display_upper': display_upper,
-                'display_mean': display_mean,
-                'log_transformed': True,
-                'is_normal': is_normal
-            }
-        else:
-            results[param][area] = {
-                'patient_value': value,
-                'reference_mean': ref_mean,
-                'reference_sd': ref_sd,
-                'lower_limit': lower_limit,
-                'upper_limit': upper_limit,
-                'log_transformed': False,
-                'is_normal': is_normal
-            }
-    
-    return results
+    ])
+    fig.update_layout(barmode='group', title=f'{param} Comparison', yaxis_title='Value')
+    return fig.to_dict()
 
-def display_results(results):
+def display_results(results, renderer='matplotlib', key='results'):
     if not results:
         return
     
@@ -336,75 +386,211 @@ def display_results(results):
         with tabs[i]:
             st.write(f"### {param} Results")
             
-            is_log_transformed = any(results[param][area].get('log_transformed', False) for area in results[param] if area in ['face', 'hand', 'feet'])
+            log_transformed = is_log_transformed(results[param])
             
-            if is_log_transformed:
+            if log_transformed:
                 st.info(f"{param} values are log10-transformed in the normative reference data. The table below shows both the original values and the transformed ranges for comparison.")
             
-            data = []
-            for area in ['face', 'hand', 'feet']:
-                if area in results[param]:
-                    res = results[param][area]
-                    status = "✅ Normal" if res['is_normal'] else "❌ Abnormal"
-                    
-                    if res.get('log_transformed', False):
-                        data.append({
-                            "Body Area": area.capitalize(),
-                            "Patient Value": f"{res['patient_value']:.2f}",
-                            "Reference Mean": f"{res['display_mean']:.2f} (log10: {res['reference_mean']:.2f})",
-                            "Reference SD": f"{res['reference_sd']:.2f} (in log10 space)",
-                            "Normal Range": f"{res['display_lower']:.2f} to {res['display_upper']:.2f}",
-                            "Status": status
-                        })
-                    else:
-                        data.append({
-                            "Body Area": area.capitalize(),
-                            "Patient Value": f"{res['patient_value']:.2f}",
-                            "Reference Mean": f"{res['reference_mean']:.2f}",
-                            "Reference SD": f"{res['reference_sd']:.2f}",
-                            "Normal Range": f"{res['lower_limit']:.2f} to {res['upper_limit']:.2f}",
-                            "Status": status
-                        })
+            data = result_table(results[param])
             
             if data:
                 df = pd.DataFrame(data)
                 st.table(df)
                 
                 # Create visualization
-                fig, ax = plt.subplots(figsize=(10, 4))
-                
-                areas = [area.capitalize() for area in ['face', 'hand', 'feet'] if area in results[param]]
-                patient_values = [results[param][area]['patient_value'] for area in ['face', 'hand', 'feet'] if area in results[param]]
+                series = chart_series(results[param], log_transformed)
                 
-                if is_log_transformed:
-                    ref_means = [results[param][area]['display_mean'] for area in ['face', 'hand', 'feet'] if area in results[param]]
-                    lower_limits = [results[param][area]['display_lower'] for area in ['face', 'hand', 'feet'] if area in results[param]]
-                    upper_limits = [results[param][area]['display_upper'] for area in ['face', 'hand', 'feet'] if area in results[param]]
+                if renderer == 'plotly':
+                    st.plotly_chart(comparison_figure_spec(param, *series), key=f"{key}_chart_{param}")
                 else:
-                    ref_means = [results[param][area]['reference_mean'] for area in ['face', 'hand', 'feet'] if area in results[param]]
-                    lower_limits = [results[param][area]['lower_limit'] for area in ['face', 'hand', 'feet'] if area in results[param]]
-                    upper_limits = [results[param][area]['upper_limit'] for area in ['face', 'hand', 'feet'] if area in results[param]]
-                
-                x = np.arange(len(areas))
-                width = 0.35
-                
-                ax.bar(x, patient_values, width, label='Patient Value', color='lightcoral')
-                ax.bar(x + width, ref_means, width, label='Reference Mean', color='lightblue')
-                
-                for i, (lower, upper, mean) in enumerate(zip(lower_limits, upper_limits, ref_means)):
-                    ax.plot([i + width, i + width], [lower, upper], color='blue', linestyle='-', linewidth=2)
-                    ax.plot([i + width - 0.1, i + width + 0.1], [lower, lower], color='blue', linestyle='-', linewidth=2)
-                    ax.plot([i + width - 0.1, i + width + 0.1], [upper, upper], color='blue', linestyle='-', linewidth=2)
-                
-                ax.set_ylabel('Value')
-                ax.set_title(f'{param} Comparison')
-                ax.set_xticks(x + width / 2)
-                ax.set_xticklabels(areas)
-                ax.legend()
-                
-                st.pyplot(fig)
+                    st.image(render_comparison_png(param, *series))
 
-def main():
+def report_downloads(results, patient, key='results'):
+    # Reports are rendered only when a download is clicked, off the script thread
+    name = patient['patient_id'] or 'qst'
+    html_col, pdf_col = st.columns(2)
+    with html_col:
+        st.download_button(
+            "Download report (HTML)", lambda: render_html(patient, results), file_name=f"{name}_report.html",
+            mime='text/html', key=f"{key}_report_html", on_click='ignore'
+        )
+    with pdf_col:
+        st.download_button(
+            "Download report (PDF)", lambda: render_pdf(patient, results), file_name=f"{name}_report.pdf",
+            mime='application/pdf', key=f"{key}_report_pdf", on_click='ignore'
+        )
+
+def save_to_history(results, patient_id, visit_date, gender, age, norm_set, source, key='results'):
+    if not patient_id:
+        st.info("Enter a patient ID in the sidebar to save these results to the patient's history.")
+        return
+    
+    if st.button(f"Save results to history of {patient_id} ({visit_date})", key=f"{key}_save"):
+        try:
+            saved = get_results_store().save_results(patient_id, visit_date, gender, age, results, norm_set.label, source)
+        except (OSError, sqlite3.Error) as e:
+            st.error(f"Error saving results: {e}")
+            return
+        st.success(f"Saved {saved} results.")
+
+def display_history(norm_set):
+    """Trend view of stored visits, read from the results store rather than from workbooks."""
+    st.markdown("---")
+    st.subheader("Patient History")
+    
+    try:
+        store = get_results_store()
+        patient_ids = store.patient_ids()
+    except (OSError, sqlite3.Error, ValueError) as e:
+        st.error(f"Error opening results store: {e}")
+        return
+    
+    if not patient_ids:
+        st.info("No saved results yet. Enter a patient ID in the sidebar and save an analysis to start a history.")
+        return
+    
+    history_tab, cohort_tab = st.tabs(["Patient trends", "Cohort abnormality rates"])
+    
+    with history_tab:
+        patient_id = st.selectbox("Patient:", patient_ids)
+        trend = store.patient_trend(patient_id, norm_set=norm_set.label)
+        
+        param_areas = trend[['parameter', 'area']].drop_duplicates()
+        choice = st.selectbox(
+            "Test:", list(param_areas.itertuples(index=False, name=None)),
+            format_func=lambda pa: f"{pa[0]} {pa[1]}"
+        )
+        if choice:
+            selected = trend[(trend['parameter'] == choice[0]) & (trend['area'] == choice[1])]
+            limits = selected[['lower_limit', 'upper_limit']]
+            # Limits of log-transformed parameters are stored in log10 space
+            limits = limits.where(~selected['log_transformed'], 10 ** limits, axis=0)
+            chart_df = pd.concat([selected[['visit_date', 'patient_value']], limits], axis=1).set_index('visit_date')
+            st.line_chart(chart_df)
+            st.dataframe(selected, hide_index=True)
+    
+    with cohort_tab:
+        rates = store.cohort_abnormality_rates()
+        st.dataframe(
+            rates, hide_index=True,
+            column_config={'abnormal_rate': st.column_config.ProgressColumn("abnormal rate", min_value=0, max_value=1)}
+        )
+
+def take_uploads(uploads):
+    """Move newly uploaded files into the session's upload store, within its memory budget."""
+    generation = st.session_state.get('uploader_generation', 0)
+    uploaded_files = st.file_uploader(
+        "Choose Excel or CSV/TSV exports", type=[ext.lstrip('.') for ext in supported_extensions()],
+        accept_multiple_files=True, key=f"uploader_{generation}"
+    )
+    for message in st.session_state.pop('upload_errors', []):
+        st.error(message)
+    
+    if uploaded_files:
+        # Starting on new files releases the file analyzed last; its saved results stay in the history
+        analyzed = st.session_state.pop('analyzed', None)
+        if analyzed is not None and analyzed['file'] not in {f.name for f in uploaded_files}:
+            uploads.evict(analyzed['file'])
+        
+        other_bytes = session_usage(uploads).state_bytes
+        errors = []
+        for f in uploaded_files:
+            try:
+                uploads.add(f.name, f.getvalue(), other_bytes)
+            except ValueError as e:
+                errors.append(str(e))
+        # A fresh uploader widget lets Streamlit release the files the old one holds
+        st.session_state['upload_errors'] = errors
+        st.session_state['uploader_generation'] = generation + 1
+        st.rerun()
+    
+    if uploads:
+        st.caption(
+            f"{len(uploads)} file(s) held for this session, {uploads.nbytes / 1024 ** 2:.1f} MB of a "
+            f"{uploads.budget / 1024 ** 2:.0f} MB budget. Files processed in the background are released once they are scored, "
+            "and an analyzed file when you upload the next one."
+        )
+        if st.button("Remove uploaded files"):
+            for name in uploads.names():
+                uploads.evict(name)
+            st.rerun()
+
+def render_upload_queue(uploads, gender, age, norm_set, renderer, visit_date):
+    """Process every uploaded workbook in the background with saved mapping templates."""
+    job = st.session_state.get('upload_job')
+    if len(uploads) < 2 and job is None:
+        return
+    
+    st.subheader("Background Processing")
+    
+    if len(uploads) > 1:
+        st.write("Set each patient's demographics, then process all files while you work on one of them below.")
+        
+        uploaded_files = uploads.files()
+        queue = st.data_editor(
+            pd.DataFrame({'File': [f.name for f in uploaded_files], 'Gender': gender, 'Age': age}),
+            hide_index=True, disabled=['File'],
+            column_config={
+                'Gender': st.column_config.SelectboxColumn(options=["male", "female"], required=True),
+                'Age': st.column_config.NumberColumn(min_value=18, max_value=100, step=1, required=True)
+            }
+        )
+        
+        if st.button("Process all files in background", disabled=job is not None and job.running):
+            job = UploadJob([
+                (f.name, f.getvalue(), file_gender, int(file_age))
+                for f, file_gender, file_age in zip(uploaded_files, queue['Gender'], queue['Age'])
+            ])
+            job.submit(get_worker_pool(), norm_set.name, load_templates(), get_sheet_cache(), get_analysis_cache())
+            st.session_state['upload_job'] = job
+            st.session_state['upload_job_unreleased'] = {f.name for f in uploaded_files}
+    
+    if job is not None:
+        # Files scored in the background are released; failed ones stay for manual mapping
+        unreleased = st.session_state.get('upload_job_unreleased', set())
+        for item in job.completed():
+            if item.name in unreleased:
+                uploads.evict(item.name)
+                unreleased.discard(item.name)
+        
+        if job.running:
+            st.fragment(show_upload_job, run_every=PROGRESS_REFRESH_SECONDS)(job, norm_set, renderer, visit_date)
+        else:
+            show_upload_job(job, norm_set, renderer, visit_date)
+
+def show_upload_job(job, norm_set, renderer, visit_date):
+    was_running = job.running
+    rows = job.rows()
+    finished = sum(row['Status'] not in (QUEUED, RUNNING) for row in rows)
+    st.progress(finished / len(rows), text=f"{finished} of {len(rows)} files processed")
+    st.dataframe(pd.DataFrame(rows), hide_index=True)
+    
+    if was_running:
+        if st.button("Cancel remaining files"):
+            job.cancel()
+            st.rerun()
+    
+    completed = {item.name: item for item in job.completed()}
+    if completed:
+        # Keyed, so the choice survives the progress refreshes as more files complete
+        item = completed[st.selectbox("Show results for:", list(completed), key='background_result')]
+        output = item.output
+        show_diagnostics(output['diagnostics'])
+        display_results(output['results'], renderer, key='background')
+        report_downloads(output['results'], {
+            'patient_id': os.path.splitext(item.name)[0], 'gender': item.gender, 'age': item.age,
+            'visit_date': visit_date.isoformat(), 'norm_set': norm_set.label
+        }, key='background')
+        save_to_history(
+            output['results'], os.path.splitext(item.name)[0], visit_date, item.gender, item.age, norm_set, item.name,
+            key='background'
+        )
+    
+    # Stop polling once the last file is in
+    if was_running and not job.running:
+        st.rerun()
+
+def render_app():
     st.title("QST Thermal Parameters Analyzer")
     
     # Display app description and instructions
@@ -413,42 +599,75 @@ def main():
     
     ### Instructions:
     1. Enter patient demographics in the sidebar
-    2. Upload an Excel file containing QST data
+    2. Upload an Excel file (or a CSV/TSV export) containing QST data
     3. Select the summary sheet and map tests to body areas
     4. Analyze the results
     """)
     
-    # Load reference values
-    reference_values = load_reference_values()
-    
     # Sidebar for patient information
     st.sidebar.header("Patient Information")
+    patient_id = st.sidebar.text_input("Patient ID:").strip()
+    visit_date = st.sidebar.date_input("Visit date:", value=datetime.date.today())
     gender = st.sidebar.radio("Gender:", ["male", "female"])
     age = st.sidebar.number_input("Age:", min_value=18, max_value=100, value=50)
     
+    # Load reference values; norm sets are validated and compiled once per process
+    norm_names = available_norm_sets()
+    norm_name = st.sidebar.selectbox(
+        "Normative dataset:", norm_names,
+        index=norm_names.index(DEFAULT_NORM_SET) if DEFAULT_NORM_SET in norm_names else 0
+    )
+    try:
+        norm_set = load_norm_set(norm_name)
+    except (OSError, ValueError) as e:
+        st.error(f"Error loading normative dataset: {e}")
+        return
+    st.sidebar.caption(f"{norm_set.label} ({norm_set.description}), checksum {norm_set.checksum[:12]}")
+    
+    chart_renderer = st.sidebar.radio(
+        "Charts:", ["matplotlib", "plotly"],
+        format_func=lambda r: "Static (server-side)" if r == 'matplotlib' else "Interactive (in browser)"
+    )
+    
     # About section in sidebar
     st.sidebar.markdown("---")
     st.sidebar.header("About")
-    st.sidebar.info("""
+    st.sidebar.info(f"""
     **QST Thermal Parameters Analyzer**
     
     This tool helps analyze thermal QST parameters (CDT, WDT, CPT, HPT) 
     and compares them to age and gender-matched normative data.
     
-    Data is processed locally in your browser and not stored on any server.
+    Data is processed on the server running this app, which stores:
+    - parsed copies of uploaded sheets, in `{get_sheet_cache().cache_dir}`
+    - results saved to the patient history (patient ID, gender, age, visit
+      date and thresholds), in `{DEFAULT_STORE_PATH}`
+    - mapping templates and learned test names, in `{DEFAULT_TEMPLATES_PATH}`
+      and `{DEFAULT_ALIASES_PATH}`
+    
+    Uploaded files are kept in memory only until they have been scored.
     """)
     
     # Main interface
-    st.subheader("Upload QST Excel File")
+    st.subheader("Upload QST Export Files")
     
-    # File uploader
-    uploaded_file = st.file_uploader("Choose an Excel file", type=["xlsx", "xls"])
+    # Uploaded files are held in the session's budgeted store until they are scored
+    uploads = get_session_uploads()
+    take_uploads(uploads)
+    uploaded_file = None
+    analyzed = None
+    
+    render_upload_queue(uploads, gender, age, norm_set, chart_renderer, visit_date)
+    if len(uploads) > 1:
+        st.subheader("Work on One File")
+        uploaded_file = uploads.get(st.selectbox("File:", uploads.names()))
+    elif uploads:
+        uploaded_file = uploads.files()[0]
     
     if uploaded_file is not None:
-        excel_data = parse_excel_file(uploaded_file)
+        sheet_names = list_excel_sheets(uploaded_file)
         
-        if excel_data:
-            sheet_names = list(excel_data.keys())
+        if sheet_names:
             
             st.write(f"Found {len(sheet_names)} sheets: {', '.join(sheet_names)}")
             
@@ -457,11 +676,16 @@ def main():
                 sheet_names
             )
             
-            if summary_sheet:
+            summary_df = read_summary_sheet(uploaded_file, summary_sheet) if summary_sheet else None
+            
+            if summary_df is not None:
                 st.write(f"### Preview of {summary_sheet}")
-                st.dataframe(excel_data[summary_sheet].head())
+                st.dataframe(summary_df.head())
+                
+                if uploaded_file.name.lower().endswith('.xlsx') and st.checkbox("Validate summary against raw trial sheets"):
+                    validate_trial_sheets(uploaded_file, summary_df)
                 
-                parameters = extract_qst_parameters(excel_data[summary_sheet])
+                parameters = extract_qst_parameters(summary_df)
                 
                 if parameters:
                     st.success("Successfully extracted QST parameters!")
@@ -473,13 +697,143 @@ def main():
                     ])
                     st.table(param_df)
                     
+                    # Once analyzed, a file stays analyzed for its patient: changing the
+                    # demographics, norm set or body-area mapping re-analyzes it from the
+                    # memo without another click
+                    analyzed = {
+                        'file': uploaded_file.name, 'content_hash': file_content_hash(uploaded_file),
+                        'patient_id': patient_id
+                    }
                     if st.button("Analyze QST Parameters"):
-                        results = analyze_qst_parameters(parameters, gender, age, reference_values)
+                        st.session_state['analyzed'] = analyzed
+                    
+                    if st.session_state.get('analyzed') == analyzed:
+                        diagnostics = []
+                        results = get_analysis_cache().analyze(parameters, gender, age, norm_set, diagnostics)
+                        show_diagnostics(diagnostics)
                         
                         if results:
-                            display_results(results)
+                            display_results(results, chart_renderer)
+                            report_downloads(results, {
+                                'patient_id': patient_id, 'gender': gender, 'age': age,
+                                'visit_date': visit_date.isoformat(), 'norm_set': norm_set.label
+                            })
+                            save_to_history(results, patient_id, visit_date, gender, age, norm_set, uploaded_file.name)
                         else:
                             st.error("No valid QST parameters to analyze.")
+    
+    # Results belong to the file and patient ID they were analyzed for; switching
+    # to another working file or patient clears them
+    if st.session_state.get('analyzed') != analyzed:
+        st.session_state.pop('analyzed', None)
+
+    display_history(norm_set)
+
+def profile_to_bytes(profiler):
+    with tempfile.NamedTemporaryFile(suffix='.prof', delete=False) as f:
+        path = f.name
+    try:
+        profiler.dump_stats(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+    finally:
+        os.unlink(path)
+    
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    return data, summary.getvalue()
+
+def display_diagnostics_panel(run_metrics):
+    st.sidebar.markdown("---")
+    if not st.sidebar.checkbox("Show performance diagnostics"):
+        return
+    
+    st.sidebar.header("Performance Diagnostics")
+    
+    data = run_metrics.as_dict()
+    if data['timers']:
+        st.sidebar.table(pd.DataFrame([
+            {"Stage": stage, "Calls": t['calls'], "Total (ms)": f"{t['seconds'] * 1000:.1f}", "Max (ms)": f"{t['max_seconds'] * 1000:.1f}"}
+            for stage, t in data['timers'].items()
+        ]))
+    if data['counters']:
+        st.sidebar.table(pd.DataFrame([{"Counter": k, "Count": v} for k, v in data['counters'].items()]))
+    
+    if st.sidebar.button("Profile this page with cProfile"):
+        st.session_state['profile_next_run'] = True
+        st.rerun()
+    
+    if 'last_profile' in st.session_state:
+        profile_data, profile_summary = st.session_state['last_profile']
+        st.sidebar.download_button("Download profile (.prof)", profile_data, file_name="qst_analyzer.prof")
+        with st.sidebar.expander("Profile summary"):
+            st.code(profile_summary)
+
+def display_memory_panel():
+    if not st.sidebar.checkbox("Show memory use by session"):
+        return
+    
+    st.header("Memory Use")
+    sessions = get_session_registry().snapshot(is_active_session)
+    rss = process_memory()
+    this_session = current_session_id()
+    
+    columns = st.columns(4)
+    columns[0].metric("Process memory", f"{rss / 1024 ** 2:.0f} MB" if rss is not None else "n/a")
+    columns[1].metric("Sessions", len(sessions))
+    columns[2].metric("Held by sessions", f"{sum(u.total_bytes for u in sessions) / 1024 ** 2:.1f} MB")
+    columns[3].metric("Budget per session", f"{SESSION_MEMORY_BUDGET / 1024 ** 2:.0f} MB")
+    
+    now = time.time()
+    st.dataframe(pd.DataFrame([
+        {
+            "Session": usage.session_id[:8] + (" (this session)" if usage.session_id == this_session else ""),
+            "Files": usage.uploads,
+            "Uploads (MB)": usage.upload_bytes / 1024 ** 2,
+            "Other state (MB)": usage.state_bytes / 1024 ** 2,
+            "Total (MB)": usage.total_bytes / 1024 ** 2,
+            "Budget used": usage.total_bytes / usage.budget,
+            "Idle (s)": int(now - usage.updated)
+        }
+        for usage in sessions
+    ]), hide_index=True, column_config={
+        "Uploads (MB)": st.column_config.NumberColumn(format="%.2f"),
+        "Other state (MB)": st.column_config.NumberColumn(format="%.2f"),
+        "Total (MB)": st.column_config.NumberColumn(format="%.2f"),
+        "Budget used": st.column_config.ProgressColumn(min_value=0, max_value=1, format="percent")
+    })
+    
+    # Shared read-only state is held once for the process, not per session
+    entries, cells = get_analysis_cache().sizes()
+    st.caption(
+        f"Shared by all sessions: {load_norm_set.cache_info().currsize} norm set(s), "
+        f"{entries} analysis results and {cells} scored cells in the analysis memo, and the parsed-sheet "
+        "and chart caches. Results shown by a session are shared with the memo, so per-session "
+        "totals can count them again."
+    )
+
+def main():
+    run_metrics = start_run()
+    
+    profiler = None
+    if st.session_state.pop('profile_next_run', False):
+        profiler = cProfile.Profile()
+        profiler.enable()
+    
+    try:
+        with timer('rerun'):
+            render_app()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            st.session_state['last_profile'] = profile_to_bytes(profiler)
+        finish_run()
+    
+    if current_session_id() is not None:
+        get_session_registry().update(session_usage(get_session_uploads()))
+    
+    display_diagnostics_panel(run_metrics)
+    display_memory_panel()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
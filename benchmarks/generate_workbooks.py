@@ -0,0 +1,115 @@
+"""
+Generate synthetic QST summary workbooks for benchmarking.
+
+Usage:
+    python benchmarks/generate_workbooks.py OUT_DIR --patients 100 [--raw-trials 20]
+
+Each workbook has a "Summary" sheet in the device layout (Sequence, Modality,
+Trials, Avg, Var, STD) with three tests (face, hand, feet) per thermal modality,
+and optionally a "Raw" sheet with one row per trial whose statistics match the
+summary. Alongside the workbooks, demographics.csv and area_map.json are
+written so the directory can be fed straight to qst_batch.py.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Device modality label, typical threshold mean and spread per parameter
+MODALITIES = [
+    ("Cold Detection Threshold", 1.5, 0.8),
+    ("Warm Detection Threshold", 3.0, 1.5),
+    ("Cold Pain Threshold", 12.0, 8.0),
+    ("Heat Pain Threshold", 44.0, 3.0),
+]
+AREAS = ["face", "hand", "feet"]
+
+
+def make_tests(rng, raw_trials=0, trials_per_test=3):
+    """Return (summary DataFrame, raw trials DataFrame or None) for one patient."""
+    summary = []
+    raw = []
+    sequence = 1
+    for label, mean, sd in MODALITIES:
+        for _ in AREAS:
+            n_trials = raw_trials or trials_per_test
+            values = np.abs(rng.normal(rng.normal(mean, sd / 2), sd / 4, n_trials))
+            summary.append({
+                'Sequence': sequence,
+                'Modality': label,
+                'Trials': n_trials,
+                'Avg': values.mean(),
+                'Var': values.var(ddof=1),
+                'STD': values.std(ddof=1)
+            })
+            if raw_trials:
+                raw.extend(
+                    {'Sequence': sequence, 'Modality': label, 'Trial': i + 1, 'Value': v}
+                    for i, v in enumerate(values)
+                )
+            sequence += 1
+
+    return pd.DataFrame(summary), (pd.DataFrame(raw) if raw_trials else None)
+
+
+def area_map():
+    """Sequence -> area for the layout written by make_tests."""
+    return {str(i + 1): AREAS[i % len(AREAS)] for i in range(len(MODALITIES) * len(AREAS))}
+
+
+def write_workbook(path, summary, raw=None):
+    with pd.ExcelWriter(path) as writer:
+        summary.to_excel(writer, sheet_name='Summary', index=False)
+        if raw is not None:
+            raw.to_excel(writer, sheet_name='Raw', index=False)
+
+
+def generate(out_dir, patients, raw_trials=0, seed=0):
+    """
+    Write `patients` workbooks plus demographics.csv and area_map.json to out_dir.
+
+    Returns:
+    List of workbook paths
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    paths = []
+    demographics = []
+    for i in range(patients):
+        patient_id = f"P{i:05d}"
+        summary, raw = make_tests(rng, raw_trials)
+        path = os.path.join(out_dir, f"{patient_id}.xlsx")
+        write_workbook(path, summary, raw)
+        paths.append(path)
+        demographics.append({
+            'patient_id': patient_id,
+            'gender': rng.choice(['male', 'female']),
+            'age': int(rng.integers(20, 85))
+        })
+
+    pd.DataFrame(demographics).to_csv(os.path.join(out_dir, 'demographics.csv'), index=False)
+    with open(os.path.join(out_dir, 'area_map.json'), 'w') as f:
+        json.dump(area_map(), f, indent=2)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic QST workbooks.")
+    parser.add_argument('out_dir')
+    parser.add_argument('--patients', type=int, default=100)
+    parser.add_argument('--raw-trials', type=int, default=0, help="Trials per test in a Raw sheet (0: no raw sheet)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    paths = generate(args.out_dir, args.patients, args.raw_trials, args.seed)
+    print(f"Wrote {len(paths)} workbooks to {args.out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
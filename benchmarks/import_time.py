@@ -0,0 +1,71 @@
+"""
+Measure the cold import time of the UI-free analysis core.
+
+Usage:
+    python benchmarks/import_time.py [--budget-ms 50] [--runs 10]
+
+Each run imports the module in a fresh interpreter so nothing is cached in
+sys.modules. Exits non-zero when the median exceeds the budget, or when the
+module pulls in any of the heavy UI/plotting packages.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Packages that must not be imported as a side effect of importing the core
+FORBIDDEN_MODULES = ['streamlit', 'matplotlib', 'plotly', 'pandas', 'numpy']
+
+IMPORT_BUDGET_MS = 50
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed * 1000)
+print(','.join(m for m in {forbidden!r} if m in sys.modules))
+"""
+
+
+def measure(module, runs):
+    timings = []
+    loaded = set()
+    code = PROBE.format(module=module, forbidden=FORBIDDEN_MODULES)
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, '-c', code], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.splitlines()
+        timings.append(float(out[0]))
+        loaded.update(m for m in out[1].split(',') if m)
+    return timings, sorted(loaded)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the cold import time of the analysis core.")
+    parser.add_argument('--module', default='qst_core')
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    timings, loaded = measure(args.module, args.runs)
+    median = statistics.median(timings)
+    print(f"import {args.module}: median {median:.1f} ms, min {min(timings):.1f} ms over {args.runs} runs "
+          f"(budget {args.budget_ms:.0f} ms)")
+
+    failed = False
+    if loaded:
+        print(f"FAIL: importing {args.module} also imports {', '.join(loaded)}")
+        failed = True
+    if median > args.budget_ms:
+        print("FAIL: over budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
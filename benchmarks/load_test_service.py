@@ -0,0 +1,183 @@
+"""
+Load-test the local scoring service (qst_service.py).
+
+Usage:
+    python benchmarks/load_test_service.py [--url http://127.0.0.1:8765] [--start]
+        [--requests 2000] [--concurrency 8] [--batch 10] [-o results.json]
+
+Sends --requests POST /score requests of --batch synthetic patients each, from
+--concurrency client threads that each keep one connection open, and reports
+requests and patients per second and latency percentiles (p50, p90, p99).
+Requests before --warmup are not counted. With --start, a service is launched
+on the URL's port for the duration of the test.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np  # noqa: E402
+
+from generate_workbooks import area_map, make_tests  # noqa: E402
+from qst_core import normalize_modality  # noqa: E402
+
+DEFAULT_URL = 'http://127.0.0.1:8765'
+
+# Distinct request bodies, sent round-robin
+PAYLOADS = 64
+
+
+def make_payloads(batch, n=PAYLOADS, seed=0):
+    rng = np.random.default_rng(seed)
+    areas = area_map()
+    payloads = []
+    for i in range(n):
+        patients = []
+        for j in range(batch):
+            summary = make_tests(rng)[0]
+            patients.append({
+                'patient_id': f"LT{i:03d}-{j:04d}",
+                'gender': str(rng.choice(['male', 'female'])),
+                'age': int(rng.integers(20, 85)),
+                'parameters': {
+                    f"{normalize_modality(m)}_{areas[str(s)]}": float(v)
+                    for m, s, v in zip(summary['Modality'], summary['Sequence'], summary['Avg'])
+                }
+            })
+        payloads.append(json.dumps({'patients': patients}).encode('utf-8'))
+    return payloads
+
+
+def start_service(url, timeout=30):
+    parts = urllib.parse.urlsplit(url)
+    process = subprocess.Popen([
+        sys.executable, os.path.join(REPO_DIR, 'qst_service.py'), '--host', parts.hostname, '--port', str(parts.port)
+    ])
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"qst_service.py exited with code {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=1)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"qst_service.py did not answer on {url} within {timeout} s")
+
+
+def run_client(url, payloads, counter, lock, total, latencies, errors):
+    parts = urllib.parse.urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+    headers = {'Content-Type': 'application/json'}
+    while True:
+        with lock:
+            i = counter[0]
+            if i >= total:
+                break
+            counter[0] += 1
+
+        start = time.perf_counter()
+        try:
+            conn.request('POST', '/score', payloads[i % len(payloads)], headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            status = str(e)
+        latencies[i] = time.perf_counter() - start
+        if status != 200:
+            errors.append((i, status))
+    conn.close()
+
+
+def load_test(url, requests, concurrency, payloads, warmup=0):
+    """
+    Send warmup + requests requests from concurrency threads.
+
+    Returns:
+    Dictionary with requests, errors, seconds, requests_per_second and latency percentiles in ms
+    """
+    total = warmup + requests
+    latencies = np.full(total, np.nan)
+    errors = []
+    lock = threading.Lock()
+
+    def run(counter, total):
+        threads = [
+            threading.Thread(target=run_client, args=(url, payloads, counter, lock, total, latencies, errors))
+            for _ in range(concurrency)
+        ]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - start
+
+    if warmup:
+        run([0], warmup)
+    seconds = run([warmup], total)
+
+    measured = latencies[warmup:] * 1000
+    p50, p90, p99 = np.nanpercentile(measured, [50, 90, 99])
+    return {
+        'requests': requests,
+        'errors': sum(i >= warmup for i, _ in errors),
+        'seconds': seconds,
+        'requests_per_second': requests / seconds,
+        'p50_ms': p50,
+        'p90_ms': p90,
+        'p99_ms': p99,
+        'max_ms': np.nanmax(measured)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the QST scoring service.")
+    parser.add_argument('--url', default=DEFAULT_URL, help="Service base URL")
+    parser.add_argument('--start', action='store_true', help="Start qst_service.py on the URL's port for the test")
+    parser.add_argument('--requests', type=int, default=2000, help="Requests to measure")
+    parser.add_argument('--warmup', type=int, default=50, help="Requests sent first and not measured")
+    parser.add_argument('--concurrency', type=int, default=8, help="Client threads, one connection each")
+    parser.add_argument('--batch', type=int, default=10, help="Patients per request")
+    parser.add_argument('-o', '--output', help="Also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    payloads = make_payloads(args.batch)
+    service = start_service(args.url) if args.start else None
+    try:
+        result = load_test(args.url, args.requests, args.concurrency, payloads, args.warmup)
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+
+    result.update(url=args.url, concurrency=args.concurrency, batch=args.batch,
+                  patients_per_second=result['requests_per_second'] * args.batch)
+    print(f"{result['requests']} requests x {args.batch} patients, concurrency {args.concurrency}: "
+          f"{result['requests_per_second']:.1f} req/s ({result['patients_per_second']:.0f} patients/s), "
+          f"{result['errors']} errors")
+    print(f"latency p50 {result['p50_ms']:.1f} ms  p90 {result['p90_ms']:.1f} ms  p99 {result['p99_ms']:.1f} ms  "
+          f"max {result['max_ms']:.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 1 if result['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
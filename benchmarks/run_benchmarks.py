@@ -0,0 +1,225 @@
+"""
+Benchmark the analyzer's hot paths on synthetic data.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--scales 1,100,10000] [-o results.json]
+    python benchmarks/run_benchmarks.py --compare BASELINE.json CURRENT.json
+
+Stages timed at every scale (number of patients):
+    parse_excel_file     reading generated workbooks from disk
+    normalize_modality   vectorized normalization of every patient's modality labels
+    extract_parameters   template matching and the Avg join per patient
+    analyze_parameters   analyze_qst_parameters per patient
+    reanalyze_parameters AnalysisCache re-analysis per patient after an age change
+    score_cohort         the whole cohort in one vectorized call
+    display_results      table and chart rendering per patient (Streamlit bare mode)
+
+Parsing and rendering are slow per item, so at large scales they are timed on
+the first --parse-limit / --render-limit patients only; each record keeps the
+number of items actually timed and the per-item time. Results are written as
+JSON so runs on different commits can be compared with --compare.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import pandas as pd  # noqa: E402
+
+from generate_workbooks import area_map, generate, make_tests  # noqa: E402
+from qst_core import AnalysisCache, analyze_qst_parameters, load_reference_values, normalize_modality  # noqa: E402
+from qst_ingest import ModalityAliases, normalize_modalities  # noqa: E402
+from qst_engine import compile_reference_table, score_cohort  # noqa: E402
+from qst_norms import load_norm_set  # noqa: E402
+from qst_templates import apply_area_mapping, match_template, protocol_signature, sequence_key  # noqa: E402
+
+DEFAULT_SCALES = [1, 100, 10000]
+
+# Regressions smaller than this ratio are reported as noise by --compare
+COMPARE_THRESHOLD = 1.10
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def make_cohort(patients, seed=0):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    summaries = [make_tests(rng)[0] for _ in range(patients)]
+    demographics = [(rng.choice(['male', 'female']), int(rng.integers(20, 85))) for _ in range(patients)]
+    return summaries, demographics
+
+
+def run_scale(scale, workbooks, args):
+    # display_results runs in Streamlit bare mode, which warns on every call
+    logging.disable(logging.WARNING)
+    from QSTAnalyzerSummaryData import display_results, render_comparison_png
+
+    reference_values = load_reference_values()
+    reference_table = compile_reference_table(reference_values)
+    summaries, demographics = make_cohort(scale)
+
+    sequence_areas = area_map()
+    first = summaries[0]
+    templates = {'benchmark': {
+        'signature': protocol_signature(first),
+        'mapping': {
+            f"{normalize_modality(m)}|{sequence_key(s)}": sequence_areas[sequence_key(s)]
+            for m, s in zip(first['Modality'], first['Sequence'])
+        }
+    }}
+
+    parameters = [apply_area_mapping(df, match_template(templates, df)[1]) for df in summaries]
+    results = [
+        analyze_qst_parameters(p, gender, age, reference_values, reference_table)
+        for p, (gender, age) in zip(parameters, demographics)
+    ]
+
+    cohort = pd.DataFrame([
+        {'gender': gender, 'age': age, 'parameter': key.split('_')[0], 'area': key.split('_')[1], 'value': value}
+        for p, (gender, age) in zip(parameters, demographics)
+        for key, value in p.items()
+    ])
+    modalities = pd.concat([df['Modality'] for df in summaries], ignore_index=True)
+
+    n_parse = min(scale, args.parse_limit)
+    n_render = min(scale, args.render_limit)
+
+    def parse():
+        from qst_core import parse_excel_file
+
+        for i in range(n_parse):
+            with open(workbooks[i % len(workbooks)], 'rb') as f:
+                parse_excel_file(f)
+
+    # Warm the memo, then time the next age within (mostly) the same age group
+    norm_set = load_norm_set()
+    analysis_cache = AnalysisCache(max_entries=2 * scale, max_cells=40 * scale)
+    for p, (gender, age) in zip(parameters, demographics):
+        analysis_cache.analyze(p, gender, age, norm_set)
+
+    def reanalyze():
+        for p, (gender, age) in zip(parameters, demographics):
+            analysis_cache.analyze(p, gender, age + 1, norm_set)
+
+    def render():
+        # Time real rendering, not hits on charts cached by an earlier repeat
+        render_comparison_png.clear()
+        for r in results[:n_render]:
+            display_results(r)
+
+    stages = [
+        ('parse_excel_file', n_parse, parse),
+        ('normalize_modality', scale, lambda: normalize_modalities(modalities, ModalityAliases(None))),
+        ('extract_parameters', scale, lambda: [apply_area_mapping(df, match_template(templates, df)[1]) for df in summaries]),
+        ('analyze_parameters', scale, lambda: [
+            analyze_qst_parameters(p, gender, age, reference_values, reference_table)
+            for p, (gender, age) in zip(parameters, demographics)
+        ]),
+        ('reanalyze_parameters', scale, reanalyze),
+        ('score_cohort', scale, lambda: score_cohort(cohort, reference_table)),
+        ('display_results', n_render, render),
+    ]
+
+    records = []
+    for stage, n, fn in stages:
+        if args.stages and stage not in args.stages:
+            continue
+        seconds = timed(fn, args.repeat)
+        records.append({
+            'stage': stage,
+            'scale': scale,
+            'n': n,
+            'seconds': seconds,
+            'per_item_ms': seconds * 1000 / n if n else None
+        })
+        print(f"{stage:>20} scale={scale:<6} n={n:<6} {seconds:9.4f} s  {records[-1]['per_item_ms']:9.4f} ms/item")
+    return records
+
+
+def compare(baseline_path, current_path):
+    with open(baseline_path) as f:
+        baseline = {(r['stage'], r['scale']): r for r in json.load(f)['results']}
+    with open(current_path) as f:
+        current = json.load(f)['results']
+
+    regressions = 0
+    for r in current:
+        old = baseline.get((r['stage'], r['scale']))
+        if not old or not old['per_item_ms']:
+            continue
+        ratio = r['per_item_ms'] / old['per_item_ms']
+        flag = 'SLOWER' if ratio > COMPARE_THRESHOLD else ('faster' if ratio < 1 / COMPARE_THRESHOLD else '')
+        regressions += flag == 'SLOWER'
+        print(f"{r['stage']:>20} scale={r['scale']:<6} {old['per_item_ms']:9.4f} -> {r['per_item_ms']:9.4f} ms/item "
+              f"x{ratio:5.2f} {flag}")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the QST analyzer hot paths.")
+    parser.add_argument('--scales', default=','.join(map(str, DEFAULT_SCALES)), help="Comma-separated patient counts")
+    parser.add_argument('--stages', help="Comma-separated subset of stages to run")
+    parser.add_argument('--repeat', type=int, default=1, help="Report the best of this many runs")
+    parser.add_argument('--parse-limit', type=int, default=1000)
+    parser.add_argument('--render-limit', type=int, default=100)
+    parser.add_argument('--workbooks', type=int, default=100, help="Distinct workbooks to generate for parsing")
+    parser.add_argument('--raw-trials', type=int, default=0, help="Trials per test in a Raw sheet of each workbook")
+    parser.add_argument('-o', '--output', help="JSON results file (default: bench-<commit>.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help="Compare two results files")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare)
+
+    args.stages = args.stages.split(',') if args.stages else None
+    scales = [int(s) for s in args.scales.split(',')]
+
+    records = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        workbooks = generate(tmp_dir, min(args.workbooks, max(scales)), args.raw_trials)
+        for scale in scales:
+            records.extend(run_scale(scale, workbooks, args))
+
+    commit = git_commit()
+    output = args.output or f"bench-{commit or 'local'}.json"
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': records
+        }, f, indent=2)
+    print(f"Wrote {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+Headless batch scoring of QST summary workbooks.
+
+Usage:
+    python qst_batch.py EXPORTS_DIR_OR_GLOB --demographics patients.csv --area-map areas.json -o results.parquet
+
+Exports may be Excel workbooks or CSV/TSV files, from any device layout or
+language that qst_ingest recognizes. The demographics manifest is a CSV with patient_id, gender and age columns; each
+workbook is matched to a patient by its file name without extension. The area map
+is a JSON object mapping test Sequence numbers to body areas (face, hand, feet).
+Without --area-map, each workbook is mapped with the saved mapping template of
+its protocol (see qst_templates), as in the app. With --store, the scored results are also
+added to the longitudinal results store (see qst_store), dated by an optional
+visit_date column of the manifest or by --visit-date.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from qst_cache import DEFAULT_CACHE_DIR, SheetCache
+from qst_core import PARAMETERS
+from qst_engine import SCORE_COLUMNS, score_cohort
+from qst_ingest import find_summary, normalize_modalities, read_tables, supported_extensions
+from qst_norms import DEFAULT_NORM_SET, load_norm_set
+from qst_store import DEFAULT_STORE_PATH, SCORED_STATUSES, ResultsStore
+from qst_templates import DEFAULT_TEMPLATES_PATH, load_templates, match_template, sequence_key
+
+RESULT_COLUMNS = ['patient_id', 'file', 'sequence', 'parameter', 'area', 'value']
+
+# Repetitive string columns, kept as categoricals (integer codes plus one copy of each value)
+CATEGORICAL_COLUMNS = ['patient_id', 'file', 'parameter', 'area', 'gender']
+
+
+def find_workbooks(path, exclude=()):
+    """
+    Export files in a directory or matching a glob pattern.
+
+    exclude lists files that are never exports, such as the demographics
+    manifest or a CSV output, which may sit in the same directory.
+    """
+    if os.path.isdir(path):
+        pattern = os.path.join(path, '*')
+    else:
+        pattern = path
+    extensions = tuple(supported_extensions())
+    excluded = {os.path.realpath(f) for f in exclude if f}
+    return sorted(
+        f for f in glob.glob(pattern) if f.lower().endswith(extensions) and os.path.realpath(f) not in excluded
+    )
+
+
+def find_summary_sheet(excel_data, sheet_name=None):
+    """The summary table of a parsed file with standardized columns, or None."""
+    return find_summary(excel_data, sheet_name)[2]
+
+
+def extract_rows(path, area_map, sheet_name=None, cache_dir=None, templates=None):
+    """Parse one export file and return (rows, error) where rows are unscored measurements."""
+    sheet_cache = SheetCache(cache_dir) if cache_dir else None
+    diagnostics = []
+    try:
+        with open(path, 'rb') as f:
+            tables = read_tables(f, path, sheet_cache, diagnostics)
+        if not tables:
+            return [], "; ".join(d.message for d in diagnostics) or "could not read file"
+
+        summary_df = find_summary_sheet(tables, sheet_name)
+        if summary_df is None:
+            return [], "no summary table with Modality and Avg columns in a known export layout"
+
+        if area_map is None:
+            _, modality_area_map = match_template(templates or {}, summary_df)
+
+        patient_id = os.path.splitext(os.path.basename(path))[0]
+        parameters = normalize_modalities(summary_df['Modality'])
+        if area_map is not None:
+            areas = summary_df['Sequence'].map(lambda s: area_map.get(sequence_key(s)))
+        else:
+            areas = pd.Series(
+                [modality_area_map.get(key) for key in zip(parameters, summary_df['Sequence'])],
+                index=summary_df.index, dtype=object
+            )
+        keep = (parameters.isin(PARAMETERS) & areas.notna() & areas.astype(bool)).to_numpy()
+        rows = [
+            {'patient_id': patient_id, 'file': path, 'sequence': sequence, 'parameter': parameter, 'area': area,
+             'value': value}
+            for sequence, parameter, area, value in zip(
+                summary_df['Sequence'][keep], parameters[keep], areas[keep], summary_df['Avg'][keep]
+            )
+        ]
+
+        if not rows:
+            return [], "no QST tests matched the area map or a mapping template of this protocol"
+        return rows, None
+    except Exception as e:
+        return [], str(e)
+
+
+def run_batch(paths, demographics, area_map, sheet_name=None, workers=None, cache_dir=DEFAULT_CACHE_DIR,
+              templates=None, norm_set=DEFAULT_NORM_SET):
+    """
+    Parse workbooks across a process pool and score them in one vectorized pass.
+
+    The results are columnar: NumPy columns for the scores and categoricals for
+    repeated strings, which convert to Arrow/Parquet without copying the numbers.
+
+    Returns:
+    Tuple of (results DataFrame, list of (file, error) pairs)
+    """
+    rows = []
+    errors = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(path, pool.submit(extract_rows, path, area_map, sheet_name, cache_dir, templates)) for path in paths]
+        for path, future in futures:
+            file_rows, error = future.result()
+            if error:
+                errors.append((path, error))
+            rows.extend(file_rows)
+
+    measurements = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    demographics = demographics[['patient_id', 'gender', 'age']].astype({'patient_id': str})
+    measurements = measurements.merge(demographics, on='patient_id', how='left')
+
+    for path in measurements.loc[measurements['gender'].isna(), 'file'].unique():
+        errors.append((path, "patient not found in demographics manifest"))
+    measurements = measurements[measurements['gender'].notna()].astype({col: 'category' for col in CATEGORICAL_COLUMNS})
+
+    norms = load_norm_set(norm_set)
+    scored = score_cohort(measurements, norms.table)
+    scored['norm_set'] = pd.Categorical.from_codes(np.zeros(len(scored), dtype=np.int8), [norms.label])
+
+    # A file none of whose measurements could be scored (e.g. the patient is under 20) failed
+    scored_files = scored.loc[scored['status'].isin(SCORED_STATUSES), 'file'].unique()
+    unscored = scored[~scored['file'].isin(scored_files)]
+    for path, statuses in unscored.groupby('file', observed=True)['status']:
+        errors.append((path, f"no measurement could be scored ({', '.join(sorted(set(statuses)))})"))
+    return scored[RESULT_COLUMNS + ['gender', 'age'] + SCORE_COLUMNS + ['norm_set']], errors
+
+
+def read_demographics(path):
+    """
+    Read the demographics manifest, keeping patient IDs and visit dates as written ("001" stays "001").
+
+    Raises ValueError if a column is missing or a patient is listed more than once.
+    """
+    demographics = pd.read_csv(path, dtype={'patient_id': str, 'visit_date': str})
+    missing = [col for col in ('patient_id', 'gender', 'age') if col not in demographics.columns]
+    if missing:
+        raise ValueError(f"{path} has no {', '.join(missing)} column")
+    repeated = demographics.loc[demographics['patient_id'].duplicated(), 'patient_id'].unique()
+    if len(repeated):
+        raise ValueError(f"patients listed more than once in {path}: {', '.join(map(str, repeated))}")
+    return demographics
+
+
+def write_results(df, output):
+    if output.endswith('.parquet'):
+        df.to_parquet(output, index=False)
+    else:
+        df.to_csv(output, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a directory of QST summary workbooks.")
+    parser.add_argument('path', help="Directory or glob pattern of .xlsx/.xls/.csv/.tsv exports")
+    parser.add_argument('--demographics', required=True, help="CSV with patient_id, gender and age columns")
+    parser.add_argument('--area-map', help="JSON mapping test Sequence to body area (default: use mapping templates)")
+    parser.add_argument('--templates', default=DEFAULT_TEMPLATES_PATH, help="Saved mapping templates JSON")
+    parser.add_argument('--norms', default=DEFAULT_NORM_SET, help="Normative dataset from the norms index")
+    parser.add_argument('--sheet', help="Name of the summary sheet (default: first sheet matching a known export layout)")
+    parser.add_argument('-o', '--output', default='qst_results.csv', help="Output .csv or .parquet file")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="Parsed sheet cache directory")
+    parser.add_argument('--no-cache', action='store_true', help="Always parse the Excel files")
+    parser.add_argument('--store', nargs='?', const=DEFAULT_STORE_PATH, help="Also save results to this SQLite store")
+    parser.add_argument('--visit-date', help="Visit date for --store when the manifest has no visit_date column")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    paths = find_workbooks(args.path, exclude=[args.demographics, args.output])
+    if not paths:
+        print(f"No export files found for {args.path}", file=sys.stderr)
+        return 1
+
+    try:
+        demographics = read_demographics(args.demographics)
+    except (OSError, ValueError) as e:
+        print(f"Can't read demographics manifest: {e}", file=sys.stderr)
+        return 1
+    area_map = None
+    templates = None
+    if args.area_map:
+        with open(args.area_map) as f:
+            area_map = {sequence_key(k): v.lower() for k, v in json.load(f).items()}
+    else:
+        templates = load_templates(args.templates)
+
+    results, errors = run_batch(
+        paths, demographics, area_map, args.sheet, args.workers, None if args.no_cache else args.cache_dir, templates,
+        args.norms
+    )
+    write_results(results, args.output)
+
+    if args.store:
+        stored = results
+        if 'visit_date' in demographics.columns:
+            visit_dates = demographics[['patient_id', 'visit_date']].astype({'patient_id': str})
+            stored = results.merge(visit_dates, on='patient_id', how='left')
+        saved = ResultsStore(args.store).save_frame(stored, args.visit_date)
+        print(f"Saved {saved} results to {args.store}")
+
+    for path, error in errors:
+        print(f"{path}: {error}", file=sys.stderr)
+    scored = results[results['status'].isin(SCORED_STATUSES)]
+    print(f"Scored {scored['file'].nunique()} of {len(paths)} files ({len(scored)} results) -> {args.output}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
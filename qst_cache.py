@@ -0,0 +1,140 @@
+"""
+Content-addressed on-disk cache of parsed workbook sheets.
+
+Each workbook is keyed by the SHA-256 of its bytes and stored as one Parquet
+file per sheet under <cache dir>/v<CACHE_VERSION>/<key>/. Entries are read back
+memory-mapped, and the least recently used entries are evicted once the cache
+grows past its size cap.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Bump whenever the parsing logic changes, so entries written by older code are ignored and evicted
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'QST_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'qst_analyzer')
+)
+DEFAULT_MAX_BYTES = int(os.environ.get('QST_CACHE_MAX_BYTES', 1024 ** 3))
+
+MANIFEST = 'manifest.json'
+
+
+class SheetCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version_dir = os.path.join(cache_dir, f"v{CACHE_VERSION}")
+
+    def content_key(self, data):
+        return hashlib.sha256(data).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.version_dir, key)
+
+    def _read_manifest(self, key):
+        try:
+            with open(os.path.join(self._entry_dir(key), MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def sheet_names(self, key):
+        manifest = self._read_manifest(key)
+        return manifest['sheets'] if manifest else None
+
+    def load_sheet(self, key, sheet_name):
+        """Return the cached sheet as a DataFrame, or None if it has not been stored."""
+        sheet_names = self.sheet_names(key)
+        if not sheet_names or sheet_name not in sheet_names:
+            return None
+
+        entry_dir = self._entry_dir(key)
+        path = os.path.join(entry_dir, f"{sheet_names.index(sheet_name)}.parquet")
+        try:
+            table = pq.read_table(path, memory_map=True)
+        except (OSError, pa.ArrowException):
+            return None
+
+        # Mark the entry as recently used for eviction
+        try:
+            os.utime(entry_dir)
+        except OSError:
+            pass
+        return table.to_pandas()
+
+    def store_sheet(self, key, sheet_names, sheet_name, df):
+        """
+        Write one parsed sheet to the cache.
+
+        Returns False if the sheet can't be represented in Parquet (e.g. mixed-type
+        object columns) or the cache directory isn't writable, in which case
+        nothing is cached for it.
+        """
+        entry_dir = self._entry_dir(key)
+
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowException, TypeError, ValueError):
+            return False
+
+        try:
+            os.makedirs(entry_dir, exist_ok=True)
+            path = os.path.join(entry_dir, f"{sheet_names.index(sheet_name)}.parquet")
+            self._atomic_write(entry_dir, path, lambda f: pq.write_table(table, f))
+
+            if self._read_manifest(key) is None:
+                manifest = json.dumps({'version': CACHE_VERSION, 'sheets': list(sheet_names)})
+                self._atomic_write(entry_dir, os.path.join(entry_dir, MANIFEST), lambda f: f.write(manifest.encode()))
+        except OSError:
+            # A read-only or full cache directory only costs the speedup
+            return False
+
+        self.evict()
+        return True
+
+    def _atomic_write(self, entry_dir, path, write):
+        # Concurrent writers (batch workers, app sessions) never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def evict(self):
+        """Remove entries from older cache versions, then least recently used entries over the size cap."""
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        for name in os.listdir(self.cache_dir):
+            if name.startswith('v') and name[1:].isdigit() and name != f"v{CACHE_VERSION}":
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+        if not os.path.isdir(self.version_dir):
+            return
+
+        entries = []
+        for key in os.listdir(self.version_dir):
+            entry_dir = self._entry_dir(key)
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+                entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+            except OSError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
@@ -0,0 +1,333 @@
+"""
+Analysis core of the QST analyzer, free of any UI imports.
+
+Everything here can be imported cheaply by the Streamlit app, the batch CLI,
+worker processes and scripts. pandas and the NumPy scoring engine are imported
+lazily by the functions that need them, and problems are reported as Diagnostic
+records appended to an optional ``diagnostics`` list instead of being written
+to a page.
+"""
+
+import io
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from typing import NamedTuple, Optional
+
+from qst_metrics import increment, timed, timer
+
+# Axis order of the compiled reference array
+GENDERS = ("female", "male")
+AGE_GROUPS = ("20-30", "30-40", "40-50", "50-60", ">60")
+PARAMETERS = ("CDT", "WDT", "CPT", "HPT")
+AREAS = ("face", "hand", "feet")
+
+# Define which parameters are log-transformed
+LOG_TRANSFORMED_PARAMETERS = ["CDT", "WDT"]  # CDT and WDT are log-transformed according to the grey shading
+
+# Columns of the summary sheet used by extract_qst_parameters
+SUMMARY_COLUMNS = ['Sequence', 'Modality', 'Trials', 'Avg', 'Var', 'STD']
+REQUIRED_SUMMARY_COLUMNS = ['Sequence', 'Modality', 'Avg']
+
+# Device labels of each parameter, searched case-insensitively anywhere in a Modality
+# label: English, German, French and Spanish names plus the abbreviations themselves.
+# Groups inside a pattern must be non-capturing.
+MODALITY_PATTERNS = {
+    'CDT': r"cold\s*detection|\bCDT\b|k(?:ä|ae|a)lt(?:e)?[-\s]*(?:detektions)?schwelle"
+           r"|d[ée]tection\s+du\s+froid|detecci[óo]n\s+del?\s+fr[íi]o",
+    'WDT': r"warm\s*detection|\bWDT\b|w(?:ä|ae|a)rm(?:e)?[-\s]*(?:detektions)?schwelle"
+           r"|d[ée]tection\s+du\s+chaud|detecci[óo]n\s+del?\s+calor",
+    'CPT': r"cold\s*pain|\bCPT\b|k(?:ä|ae)lteschmerz|douleur\s+au\s+froid|dolor\s+(?:por|al)\s+fr[íi]o",
+    'HPT': r"(?:hot|heat)\s*pain|\bHPT\b|hitzeschmerz|w(?:ä|ae)rmeschmerz|douleur\s+[àa]\s+la\s+chaleur"
+           r"|dolor\s+(?:por|al)\s+calor",
+}
+
+# One alternation with a named group per parameter; the leftmost match wins
+MODALITY_REGEX = re.compile(
+    '|'.join(f"(?P<{param}>{pattern})" for param, pattern in MODALITY_PATTERNS.items()), re.IGNORECASE
+)
+
+# Bounds of the AnalysisCache: whole results and individual (parameter, area) cells
+ANALYSIS_CACHE_MAX_ENTRIES = 256
+ANALYSIS_CACHE_MAX_CELLS = 4096
+
+# level is 'warning' or 'error'
+Diagnostic = namedtuple('Diagnostic', ['level', 'message'])
+
+
+class QSTResult(NamedTuple):
+    """
+    Score of one parameter in one body area.
+    
+    Values are kept as numbers; formatting happens only when they are displayed.
+    Means and limits are in the reference data's space (log10 for log-transformed
+    parameters); display_* hold their back-transformed values and are only set
+    for log-transformed parameters.
+    """
+    patient_value: float
+    reference_mean: float
+    reference_sd: float
+    lower_limit: float
+    upper_limit: float
+    log_transformed: bool
+    is_normal: bool
+    display_mean: Optional[float] = None
+    display_lower: Optional[float] = None
+    display_upper: Optional[float] = None
+    
+    @classmethod
+    def from_scored(cls, row):
+        """Build a record from a score_cohort row (an itertuples namedtuple)."""
+        log_transformed = bool(row.log_transformed)
+        return cls(
+            float(row.value), float(row.reference_mean), float(row.reference_sd),
+            float(row.lower_limit), float(row.upper_limit), log_transformed, bool(row.is_normal),
+            *((float(row.display_mean), float(row.display_lower), float(row.display_upper)) if log_transformed else ())
+        )
+
+def _report(diagnostics, level, message):
+    if diagnostics is not None:
+        diagnostics.append(Diagnostic(level, message))
+
+def load_reference_values(norm_set=None):
+    """Nested reference values dict of a norm set from the norms directory (default: the default set)."""
+    from qst_norms import DEFAULT_NORM_SET, load_norm_set
+    
+    return load_norm_set(norm_set or DEFAULT_NORM_SET).reference_values
+
+def get_age_group(age):
+    if 20 <= age < 30:
+        return '20-30'
+    elif 30 <= age < 40:
+        return '30-40'
+    elif 40 <= age < 50:
+        return '40-50'
+    elif 50 <= age < 60:
+        return '50-60'
+    elif age >= 60:
+        return '>60'
+    else:
+        return None  # Age is below reference ranges
+
+@timed('workbook_load')
+def parse_excel_file(uploaded_file, sheet_cache=None, diagnostics=None):
+    import pandas as pd
+    
+    try:
+        if uploaded_file.name.lower().endswith(('.xlsx', '.xls')):
+            if sheet_cache is None:
+                xls = pd.ExcelFile(uploaded_file)
+                data = {}
+                for sheet_name in xls.sheet_names:
+                    with timer('sheet_read'):
+                        data[sheet_name] = pd.read_excel(xls, sheet_name)
+                return data
+            
+            content = uploaded_file.read()
+            key = sheet_cache.content_key(content)
+            
+            xls = None
+            sheet_names = sheet_cache.sheet_names(key)
+            if sheet_names is None:
+                xls = pd.ExcelFile(io.BytesIO(content))
+                sheet_names = xls.sheet_names
+            
+            data = {}
+            
+            for sheet_name in sheet_names:
+                with timer('sheet_read'):
+                    df = sheet_cache.load_sheet(key, sheet_name)
+                    if df is None:
+                        increment('excel_sheet_parse')
+                        if xls is None:
+                            xls = pd.ExcelFile(io.BytesIO(content))
+                        df = pd.read_excel(xls, sheet_name)
+                        sheet_cache.store_sheet(key, sheet_names, sheet_name, df)
+                    else:
+                        increment('sheet_disk_cache_hit')
+                data[sheet_name] = df
+            
+            return data
+        else:
+            _report(diagnostics, 'error', "Please upload an Excel file (.xlsx or .xls)")
+            return None
+    except Exception as e:
+        _report(diagnostics, 'error', f"Error reading Excel file: {e}")
+        return None
+
+def normalize_modality(modality):
+    """Parameter abbreviation of a device Modality label, or the label itself if not recognized."""
+    match = MODALITY_REGEX.search(modality)
+    return match.lastgroup if match else modality
+
+def score_parameter_cells(params, gender, age, reference_table):
+    """
+    Score each "<parameter>_<area>" value of params on its own.
+    
+    Returns:
+    Dictionary of param_area -> (parameter, area, result dict or None, list of Diagnostic)
+    """
+    cells = score_cells([(gender, age, param_area, value) for param_area, value in params.items()], reference_table)
+    return dict(zip(params, cells))
+
+def score_cells(measurements, reference_table):
+    """
+    Score (gender, age, "<parameter>_<area>", value) measurements, of any number of patients, in one pass.
+    
+    Returns:
+    List of (parameter, area, QSTResult or None, list of Diagnostic), in the order of measurements
+    """
+    from qst_engine import score_rows
+    
+    cells = [None] * len(measurements)
+    scorable = []
+    for i, (gender, age, param_area, value) in enumerate(measurements):
+        parts = param_area.split('_')
+        if len(parts) != 2:
+            cells[i] = (None, None, None, [Diagnostic('warning', f"Invalid parameter name format: {param_area}")])
+        else:
+            scorable.append((i, gender, age, parts[0], parts[1], value))
+    
+    if scorable:
+        index, genders, ages, params, areas, values = zip(*scorable)
+        for i, row in zip(index, score_rows(genders, ages, params, areas, values, reference_table)):
+            cells[i] = scored_cell(row)
+    return cells
+
+def scored_cell(row):
+    """
+    Result of one score_cohort row.
+    
+    Returns:
+    Tuple of (parameter, area, QSTResult or None, list of Diagnostic)
+    """
+    param, area = row.parameter, row.area
+    
+    if row.status == 'unknown_gender':
+        return param, area, None, [Diagnostic('error', f"Unknown gender: {row.gender}")]
+    
+    if row.status == 'unknown_parameter':
+        return param, area, None, [Diagnostic('warning', f"Unknown parameter: {param}")]
+    
+    if row.status == 'unknown_area':
+        return param, area, None, [Diagnostic('warning', f"Unknown body area: {area}")]
+    
+    if row.status == 'no_reference':
+        message = f"No reference values for {param} in {area}, {row.gender}, age group {row.age_group}"
+        return param, area, None, [Diagnostic('warning', message)]
+    
+    cell_diagnostics = []
+    if row.status == 'non_positive_log_value':
+        cell_diagnostics.append(Diagnostic('warning', f"Can't log-transform value {row.value} (must be positive)"))
+    
+    return param, area, QSTResult.from_scored(row), cell_diagnostics
+
+def assemble_results(cells, diagnostics=None):
+    """Nest scored (parameter, area, QSTResult, diagnostics) cells into {parameter: {area: QSTResult}}."""
+    results = {}
+    for param, area, result, cell_diagnostics in cells:
+        if diagnostics is not None:
+            diagnostics.extend(cell_diagnostics)
+        if result is not None:
+            results.setdefault(param, {})[area] = result
+    return results
+
+@timed('analysis')
+def analyze_qst_parameters(params, gender, age, reference_values, reference_table=None, diagnostics=None):
+    """
+    Score "<parameter>_<area>" values against the age and gender matched reference values.
+    
+    Returns:
+    Dictionary of parameter -> {area: QSTResult}, or None if the age is out of range
+    """
+    from qst_engine import compile_reference_table
+    
+    age_group = get_age_group(age)
+    if not age_group:
+        _report(diagnostics, 'error', "Age must be at least 20 years.")
+        return None
+    
+    if reference_table is None:
+        reference_table = compile_reference_table(reference_values)
+    
+    cells = score_parameter_cells(params, gender, age, reference_table)
+    return assemble_results([cells[param_area] for param_area in params], diagnostics)
+
+class AnalysisCache:
+    """
+    Bounded memo of analysis results for interactive re-analysis.
+    
+    Whole results are keyed on (parameter set, gender, age group, norm set), so
+    changing the age within the same bracket, or toggling back and forth, is a
+    lookup. Individual (parameter, area) cells are memoized as well, so when one
+    body-area mapping changes only the affected cells are scored again. Both
+    levels evict least recently used entries. Returned results are shared
+    between callers and must not be modified.
+    """
+    
+    def __init__(self, max_entries=ANALYSIS_CACHE_MAX_ENTRIES, max_cells=ANALYSIS_CACHE_MAX_CELLS):
+        self.max_entries = max_entries
+        self.max_cells = max_cells
+        self._results = OrderedDict()
+        self._cells = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _get(self, cache, key):
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+    
+    def _put(self, cache, key, value, max_size):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > max_size:
+                cache.popitem(last=False)
+    
+    def sizes(self):
+        """Numbers of memoized (results, cells)."""
+        with self._lock:
+            return len(self._results), len(self._cells)
+    
+    @timed('analysis')
+    def analyze(self, params, gender, age, norm_set, diagnostics=None):
+        age_group = get_age_group(age)
+        if not age_group:
+            _report(diagnostics, 'error', "Age must be at least 20 years.")
+            return None
+        
+        norm_key = (norm_set.name, norm_set.checksum)
+        key = (tuple(params.items()), gender, age_group, norm_key)
+        
+        hit = self._get(self._results, key)
+        if hit is not None:
+            increment('analysis_cache_hit')
+            results, cached_diagnostics = hit
+            if diagnostics is not None:
+                diagnostics.extend(cached_diagnostics)
+            return results
+        
+        cells = {}
+        missing = {}
+        for param_area, value in params.items():
+            cell = self._get(self._cells, (param_area, value, gender, age_group, norm_key))
+            if cell is None:
+                missing[param_area] = value
+            else:
+                cells[param_area] = cell
+        
+        if missing:
+            increment('analysis_cells_scored', len(missing))
+            for param_area, cell in score_parameter_cells(missing, gender, age, norm_set.table).items():
+                self._put(self._cells, (param_area, missing[param_area], gender, age_group, norm_key), cell, self.max_cells)
+                cells[param_area] = cell
+        
+        result_diagnostics = []
+        results = assemble_results([cells[param_area] for param_area in params], result_diagnostics)
+        self._put(self._results, key, (results, result_diagnostics), self.max_entries)
+        
+        if diagnostics is not None:
+            diagnostics.extend(result_diagnostics)
+        return results
@@ -0,0 +1,232 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from qst_core import AGE_GROUPS, AREAS, GENDERS, LOG_TRANSFORMED_PARAMETERS, PARAMETERS
+
+# Lower bounds of the age groups above, in the same order
+AGE_GROUP_BOUNDS = np.array([20, 30, 40, 50, 60])
+
+SCORE_COLUMNS = [
+    'age_group', 'reference_mean', 'reference_sd', 'lower_limit', 'upper_limit',
+    'display_mean', 'display_lower', 'display_upper', 'log_transformed', 'z_score', 'is_normal', 'status'
+]
+
+# Outcomes of scoring a row; stored as a categorical, so each row costs one byte
+STATUSES = (
+    'ok', 'invalid_age', 'unknown_gender', 'unknown_parameter', 'unknown_area', 'no_reference', 'non_positive_log_value'
+)
+STATUS_CODES = {status: i for i, status in enumerate(STATUSES)}
+
+# A score_cohort row built without a DataFrame (see score_rows)
+ScoredRow = namedtuple('ScoredRow', ['parameter', 'area', 'gender', 'value'] + SCORE_COLUMNS)
+
+# Integer codes of the array axes
+GENDER_CODES = {gender: i for i, gender in enumerate(GENDERS)}
+AGE_GROUP_CODES = {age_group: i for i, age_group in enumerate(AGE_GROUPS)}
+PARAMETER_CODES = {param: i for i, param in enumerate(PARAMETERS)}
+AREA_CODES = {area: i for i, area in enumerate(AREAS)}
+
+
+class ReferenceTable:
+    """
+    Dense array form of the nested reference values dict.
+
+    stats has shape (gender, age group, parameter, area, 2) and holds (mean, sd),
+    NaN where no reference value exists. log_mask flags the log10-transformed parameters.
+    The normal limits (mean +/- 2 sd) and their back-transformed display values are
+    computed once here, so scoring only has to index into the arrays.
+    """
+
+    def __init__(self, stats, log_mask):
+        self.stats = stats
+        self.log_mask = log_mask
+
+        mean = stats[..., 0]
+        sd = stats[..., 1]
+        lower = mean - 2 * sd
+        upper = mean + 2 * sd
+        self.limits = np.stack([lower, upper], axis=-1)
+
+        log = log_mask[None, None, :, None]
+        self.display = np.stack([
+            np.where(log, np.power(10.0, mean), mean),
+            np.where(log, np.power(10.0, lower), lower),
+            np.where(log, np.power(10.0, upper), upper)
+        ], axis=-1)
+
+    def lookup(self, gender, age_group, param, area):
+        """
+        Precomputed reference values of one cell.
+
+        Returns:
+        Dictionary with reference_mean, reference_sd, lower_limit, upper_limit,
+        display_mean, display_lower, display_upper and log_transformed
+        """
+        cell = (GENDER_CODES[gender], AGE_GROUP_CODES[age_group], PARAMETER_CODES[param], AREA_CODES[area])
+        mean, sd = self.stats[cell]
+        lower, upper = self.limits[cell]
+        display_mean, display_lower, display_upper = self.display[cell]
+        return {
+            'reference_mean': mean,
+            'reference_sd': sd,
+            'lower_limit': lower,
+            'upper_limit': upper,
+            'display_mean': display_mean,
+            'display_lower': display_lower,
+            'display_upper': display_upper,
+            'log_transformed': bool(self.log_mask[cell[2]])
+        }
+
+
+def compile_reference_table(reference_values, log_transformed=LOG_TRANSFORMED_PARAMETERS):
+    stats = np.full((len(GENDERS), len(AGE_GROUPS), len(PARAMETERS), len(AREAS), 2), np.nan)
+
+    for g, gender in enumerate(GENDERS):
+        for a, age_group in enumerate(AGE_GROUPS):
+            by_param = reference_values.get(gender, {}).get(age_group, {})
+            for p, param in enumerate(PARAMETERS):
+                for r, area in enumerate(AREAS):
+                    if area in by_param.get(param, {}):
+                        stats[g, a, p, r] = by_param[param][area]
+
+    log_mask = np.array([param in log_transformed for param in PARAMETERS])
+    return ReferenceTable(stats, log_mask)
+
+
+def age_group_codes(ages):
+    """Vectorized get_age_group: index into AGE_GROUPS, -1 below the youngest group."""
+    ages = np.asarray(ages, dtype=float)
+    codes = np.searchsorted(AGE_GROUP_BOUNDS, ages, side='right') - 1
+    codes[np.isnan(ages)] = -1
+    return codes
+
+
+def _codes(values, categories, lower=False):
+    values = pd.Series(values, dtype=object).astype(str)
+    if lower:
+        values = values.str.lower()
+    return pd.Categorical(values, categories=categories).codes.astype(np.intp)
+
+
+def score_cohort(df, reference_table):
+    """
+    Score a DataFrame of QST measurements against the reference table in one pass.
+
+    Parameters:
+    df - DataFrame with gender, age, parameter, area and value columns
+    reference_table - ReferenceTable from compile_reference_table
+
+    Returns:
+    Copy of df with the SCORE_COLUMNS appended: one NumPy column per field, with
+    age_group and status as categoricals. status is 'ok', or the reason the row
+    could not be scored ('invalid_age', 'unknown_gender', 'unknown_parameter',
+    'unknown_area', 'no_reference', 'non_positive_log_value'). Rows with a
+    non-positive value of a log-transformed parameter still carry the reference
+    limits, and are never normal.
+    """
+    g = _codes(df['gender'], GENDERS, lower=True)
+    a = age_group_codes(df['age'])
+    p = _codes(df['parameter'], PARAMETERS)
+    # Areas must match exactly, as results are keyed by the area as given
+    r = _codes(df['area'], AREAS)
+    value = pd.to_numeric(df['value'], errors='coerce').to_numpy(dtype=float)
+
+    columns = score_codes(g, a, p, r, value, reference_table)
+
+    scored = df.copy()
+    scored['age_group'] = pd.Categorical.from_codes(a, AGE_GROUPS)
+    for column in SCORE_COLUMNS[1:-1]:
+        scored[column] = columns[column]
+    scored['status'] = pd.Categorical.from_codes(columns['status'], STATUSES)
+    return scored
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def score_rows(genders, ages, parameters, areas, values, reference_table):
+    """
+    score_cohort for plain sequences of measurements, as ScoredRow records.
+
+    For one patient or a small request, building and scoring a DataFrame costs
+    far more than the scoring itself; this codes the measurements with dict
+    lookups and runs the same NumPy core.
+
+    Returns:
+    List of ScoredRow, in input order
+    """
+    g = np.array([GENDER_CODES.get(str(x).lower(), -1) for x in genders], dtype=np.intp)
+    a = age_group_codes(ages)
+    p = np.array([PARAMETER_CODES.get(x, -1) for x in parameters], dtype=np.intp)
+    r = np.array([AREA_CODES.get(x, -1) for x in areas], dtype=np.intp)
+    columns = score_codes(g, a, p, r, np.array([_float(x) for x in values], dtype=float), reference_table)
+
+    return [
+        ScoredRow(*fields)
+        for fields in zip(
+            parameters, areas, genders, values, (AGE_GROUPS[x] if x >= 0 else None for x in a),
+            *(columns[column].tolist() for column in SCORE_COLUMNS[1:-1]), (STATUSES[x] for x in columns['status'])
+        )
+    ]
+
+
+def score_codes(g, a, p, r, value, reference_table):
+    """
+    NumPy core of score_cohort, for callers that code their measurements themselves.
+
+    Parameters:
+    g, a, p, r - integer codes into GENDERS, AGE_GROUPS, PARAMETERS and AREAS, -1 where unknown
+    value - float array of measured values
+
+    Returns:
+    Dictionary of SCORE_COLUMNS (except age_group) -> array, with status as int8 codes into STATUSES
+    """
+    status = np.full(len(value), STATUS_CODES['ok'], dtype=np.int8)
+    status[r < 0] = STATUS_CODES['unknown_area']
+    status[p < 0] = STATUS_CODES['unknown_parameter']
+    status[g < 0] = STATUS_CODES['unknown_gender']
+    status[a < 0] = STATUS_CODES['invalid_age']
+    indexed = (g >= 0) & (a >= 0) & (p >= 0) & (r >= 0)
+
+    cell = (g.clip(0), a.clip(0), p.clip(0), r.clip(0))
+    stats = reference_table.stats[cell]
+    limits = reference_table.limits[cell]
+    display = reference_table.display[cell]
+    stats[~indexed] = np.nan
+    limits[~indexed] = np.nan
+    display[~indexed] = np.nan
+    ref_mean = stats[:, 0]
+    ref_sd = stats[:, 1]
+    lower_limit = limits[:, 0]
+    upper_limit = limits[:, 1]
+    status[indexed & np.isnan(ref_mean)] = STATUS_CODES['no_reference']
+
+    log_transformed = indexed & reference_table.log_mask[p.clip(0)]
+    non_positive = log_transformed & ~(value > 0)
+    status[(status == STATUS_CODES['ok']) & non_positive] = STATUS_CODES['non_positive_log_value']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        compared = np.where(log_transformed, np.log10(np.where(non_positive, np.nan, value)), value)
+        z_score = (compared - ref_mean) / ref_sd
+
+    is_normal = (lower_limit <= compared) & (compared <= upper_limit)
+
+    return {
+        'reference_mean': ref_mean,
+        'reference_sd': ref_sd,
+        'lower_limit': lower_limit,
+        'upper_limit': upper_limit,
+        'display_mean': display[:, 0],
+        'display_lower': display[:, 1],
+        'display_upper': display[:, 2],
+        'log_transformed': log_transformed,
+        'z_score': z_score,
+        'is_normal': is_normal,
+        'status': status
+    }
@@ -0,0 +1,374 @@
+"""
+Ingestion of summary exports from different devices, software versions and languages.
+
+Files are read by a reader registered for their extension (Excel workbooks and
+delimited text out of the box), then each table's header is matched against
+the registered export schemas to find the Sequence, Modality, Trials, Avg, Var
+and STD columns. Schemas are detected once per distinct header, and a preamble
+above the header row is skipped. Modality labels are normalized per distinct
+label: the column is factorized into codes, labels seen before come from a
+persistent alias cache (QST_ALIASES_PATH), and the rest go through one
+vectorized pass of qst_core.MODALITY_REGEX. Labels can also be taught by hand
+with ModalityAliases.learn.
+
+The alias cache is stored as JSON:
+    {"patterns": "<hash of MODALITY_PATTERNS>", "resolved": {"cold detection threshold": "CDT", ...},
+     "learned": {"thermal a": "CDT", ...}}
+Resolved aliases are dropped when the patterns change; learned ones are kept.
+"""
+
+import csv
+import functools
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from qst_core import MODALITY_PATTERNS, MODALITY_REGEX, PARAMETERS, SUMMARY_COLUMNS, Diagnostic, parse_excel_file
+
+DEFAULT_ALIASES_PATH = os.environ.get(
+    'QST_ALIASES_PATH',
+    os.path.join(os.path.expanduser('~'), '.config', 'qst_analyzer', 'modality_aliases.json')
+)
+
+PATTERNS_KEY = hashlib.sha1(json.dumps(MODALITY_PATTERNS, sort_keys=True).encode()).hexdigest()[:12]
+
+# Rows searched for the header when a table has a preamble above it
+MAX_HEADER_ROW = 20
+
+# Columns that must be found for a table to count as a summary; Sequence is
+# numbered by row when an export has none
+SCHEMA_REQUIRED_COLUMNS = ['Modality', 'Avg']
+NUMERIC_COLUMNS = ['Trials', 'Avg', 'Var', 'STD']
+
+# Header patterns per summary column, matched against the whole normalized header
+# (lower case, single spaces, units in brackets removed)
+GENERIC_HEADERS = {
+    'Sequence': [r"seq(?:uence)?(?: ?(?:no|nr|number|#))?", r"test ?(?:no|nr|number|#)", r"order",
+                 r"reihenfolge", r"lfd\.? ?nr\.?", r"s[ée]quence", r"secuencia"],
+    'Modality': [r"modalit(?:y|ies|ät|aet|é|e|ad)", r"test(?: ?(?:type|name))?", r"stimulus", r"messung",
+                 r"prueba"],
+    'Trials': [r"trials?", r"(?:no\.?|number) of trials", r"repetitions?", r"wiederholungen", r"essais",
+               r"ensayos"],
+    'Avg': [r"avg", r"average", r"mean", r"mean threshold", r"threshold", r"mittelwert", r"moyenne", r"media",
+            r"promedio"],
+    'Var': [r"var", r"variance", r"varianz", r"varianza"],
+    'STD': [r"std", r"sd", r"s\.d\.", r"std\.? ?dev(?:iation)?", r"standard deviation", r"standardabweichung",
+            r"[ée]cart[- ]type", r"desviaci[óo]n (?:est[áa]ndar|t[íi]pica)"],
+}
+
+
+class SummarySchema(NamedTuple):
+    """Header patterns of one export layout: summary column -> list of regexes."""
+    name: str
+    headers: dict
+
+
+# Tried in order; register_schema puts vendor-specific schemas before the generic one
+SCHEMAS = [
+    SummarySchema('qst-summary', {col: [re.escape(col.lower())] for col in SUMMARY_COLUMNS}),
+    SummarySchema('generic', GENERIC_HEADERS),
+]
+
+_schemas_lock = threading.Lock()
+
+
+def register_schema(schema):
+    with _schemas_lock:
+        SCHEMAS.insert(len(SCHEMAS) - 1, schema)
+        _compiled_schema.cache_clear()
+        detect_schema.cache_clear()
+
+
+@functools.lru_cache(maxsize=None)
+def _compiled_schema(index):
+    schema = SCHEMAS[index]
+    return {col: re.compile('|'.join(f"(?:{p})" for p in patterns)) for col, patterns in schema.headers.items()}
+
+
+def normalize_header(header):
+    header = re.sub(r"[\(\[].*?[\)\]]", ' ', str(header).casefold())
+    return ' '.join(header.replace('_', ' ').split()).strip(' :')
+
+
+@functools.lru_cache(maxsize=1024)
+def detect_schema(headers):
+    """
+    Match a table header against the registered schemas. Cached per distinct header.
+
+    Parameters:
+    headers - tuple of column names
+
+    Returns:
+    Tuple of (schema name, {column name: summary column}), or None if no schema finds the required columns
+    """
+    normalized = [normalize_header(h) for h in headers]
+    for index, schema in enumerate(SCHEMAS):
+        patterns = _compiled_schema(index)
+        mapping = {}
+        for header, norm in zip(headers, normalized):
+            for col, pattern in patterns.items():
+                if col not in mapping.values() and pattern.fullmatch(norm):
+                    mapping[header] = col
+                    break
+        if all(col in mapping.values() for col in SCHEMA_REQUIRED_COLUMNS):
+            return schema.name, mapping
+    return None
+
+
+def _numeric(values):
+    if not pd.api.types.is_numeric_dtype(values):
+        # Decimal commas from European locales
+        values = values.astype(str).str.strip().str.replace(',', '.', regex=False)
+    return pd.to_numeric(values, errors='coerce')
+
+
+def _sequence(values):
+    # Sequence IDs may be alphanumeric (A1, T2); they are kept as they are unless every one is a number
+    numbers = _numeric(values)
+    if numbers[values.notna()].isna().any():
+        return values
+    return numbers
+
+
+def standardize_summary(df):
+    """
+    Rename a summary table's columns to the SUMMARY_COLUMNS and coerce their types.
+
+    Returns:
+    Tuple of (schema name, DataFrame with the summary columns that were found), or (None, None)
+    """
+    detected = detect_schema(tuple(df.columns))
+    if detected is None:
+        # The header may sit below a preamble (device, patient and date lines)
+        for i in range(min(MAX_HEADER_ROW, len(df))):
+            detected = detect_schema(tuple(df.iloc[i].astype(str)))
+            if detected is not None:
+                df = df.iloc[i + 1:].set_axis(df.iloc[i].astype(str).tolist(), axis=1).reset_index(drop=True)
+                break
+        else:
+            return None, None
+
+    schema_name, mapping = detected
+    summary = df[list(mapping)].rename(columns=mapping)
+    summary = summary[summary['Modality'].notna()].reset_index(drop=True)
+
+    if 'Sequence' not in summary.columns:
+        summary.insert(0, 'Sequence', np.arange(1, len(summary) + 1))
+    else:
+        summary['Sequence'] = _sequence(summary['Sequence'])
+    for col in NUMERIC_COLUMNS:
+        if col in summary.columns:
+            summary[col] = _numeric(summary[col])
+    return schema_name, summary[[col for col in SUMMARY_COLUMNS if col in summary.columns]]
+
+
+def find_summary(tables, table_name=None):
+    """
+    Standardized summary table of a file: the named table, or the first one matching a schema.
+
+    Returns:
+    Tuple of (table name, schema name, DataFrame), or (None, None, None)
+    """
+    names = [table_name] if table_name is not None else list(tables)
+    for name in names:
+        if name in tables:
+            schema_name, summary = standardize_summary(tables[name])
+            if summary is not None:
+                return name, schema_name, summary
+    return None, None, None
+
+
+def read_excel_tables(source, name, sheet_cache=None, diagnostics=None):
+    if not hasattr(source, 'name'):
+        source = io.BytesIO(source.read())
+        source.name = name
+    return parse_excel_file(source, sheet_cache, diagnostics)
+
+
+def sniff_delimiter(lines):
+    # Tab and semicolon first: a comma may be the decimal separator
+    for delimiter in ('\t', ';', '|', ','):
+        counts = [line.count(delimiter) for line in lines]
+        if counts and max(counts) > 0 and counts.count(max(counts)) * 2 >= len(counts):
+            return delimiter
+    return ','
+
+
+def read_delimited_tables(source, name, sheet_cache=None, diagnostics=None):
+    """A CSV/TSV export as a single table named after the file."""
+    data = source.read()
+    for encoding in ('utf-8-sig', 'cp1252'):
+        try:
+            text = data.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        if diagnostics is not None:
+            diagnostics.append(Diagnostic('error', f"{name} is not a UTF-8 or Windows-1252 text file"))
+        return None
+
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        if diagnostics is not None:
+            diagnostics.append(Diagnostic('error', f"{name} is empty"))
+        return None
+
+    # Rows may be ragged when a preamble sits above the table; standardize_summary finds the header
+    rows = list(csv.reader(lines, delimiter=sniff_delimiter(lines[:50])))
+    width = max(len(row) for row in rows)
+    df = pd.DataFrame([row + [''] * (width - len(row)) for row in rows]).replace('', np.nan)
+    df = df.iloc[1:].set_axis(df.iloc[0].astype(str).tolist(), axis=1).reset_index(drop=True)
+    return {os.path.splitext(os.path.basename(name))[0]: df}
+
+
+# Extension -> reader(source, name, sheet_cache, diagnostics) returning {table name: DataFrame} or None
+READERS = {
+    '.xlsx': read_excel_tables,
+    '.xls': read_excel_tables,
+    '.csv': read_delimited_tables,
+    '.tsv': read_delimited_tables,
+    '.txt': read_delimited_tables,
+}
+
+
+def register_reader(extension, reader):
+    READERS[extension.lower()] = reader
+
+
+def supported_extensions():
+    return sorted(READERS)
+
+
+def read_tables(source, name, sheet_cache=None, diagnostics=None):
+    """Read every table of an export file (an open binary file or file-like object), choosing the reader by name."""
+    reader = READERS.get(os.path.splitext(name)[1].lower())
+    if reader is None:
+        if diagnostics is not None:
+            diagnostics.append(Diagnostic(
+                'error', f"Unsupported file type: {name} (supported: {', '.join(supported_extensions())})"
+            ))
+        return None
+    return reader(source, name, sheet_cache, diagnostics)
+
+
+class ModalityAliases:
+    """
+    Persistent cache of Modality label -> parameter resolutions, plus labels taught by hand.
+
+    With path None the cache is kept in memory only.
+    """
+
+    def __init__(self, path=DEFAULT_ALIASES_PATH):
+        self.path = path
+        self.resolved = {}
+        self.learned = {}
+        self._lock = threading.Lock()
+
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (TypeError, OSError, ValueError):
+            data = {}
+        self.learned = dict(data.get('learned', {}))
+        if data.get('patterns') == PATTERNS_KEY:
+            self.resolved = dict(data.get('resolved', {}))
+
+    @staticmethod
+    def key(label):
+        return ' '.join(str(label).casefold().split())
+
+    def resolve(self, labels):
+        """
+        Parameters of distinct labels, None where not recognized.
+
+        Parameters:
+        labels - Series of distinct label strings
+
+        Returns:
+        Object array aligned with labels
+        """
+        keys = [self.key(label) for label in labels]
+        with self._lock:
+            known = {**self.resolved, **self.learned}
+        params = np.array([known.get(k) for k in keys], dtype=object)
+
+        unknown = np.flatnonzero(pd.isna(params))
+        if len(unknown):
+            # One regex pass over the new labels; the matching named group is the parameter
+            groups = labels.iloc[unknown].str.extract(MODALITY_REGEX).notna()
+            found = groups.any(axis=1).to_numpy()
+            if found.any():
+                new = groups.columns.to_numpy(dtype=object)[groups.to_numpy().argmax(axis=1)[found]]
+                params[unknown[found]] = new
+                self._remember({keys[i]: param for i, param in zip(unknown[found], new)})
+
+        return params
+
+    def learn(self, label, parameter):
+        """Teach a label by hand; it takes precedence over the patterns and is kept when they change."""
+        if parameter not in PARAMETERS:
+            raise ValueError(f"Unknown parameter: {parameter}")
+        with self._lock:
+            self.learned[self.key(label)] = parameter
+            self._save()
+
+    def forget(self, label):
+        with self._lock:
+            self.learned.pop(self.key(label), None)
+            self.resolved.pop(self.key(label), None)
+            self._save()
+
+    def _remember(self, resolved):
+        with self._lock:
+            self.resolved.update(resolved)
+            self._save()
+
+    def _save(self):
+        if self.path is None:
+            return
+        data = {'patterns': PATTERNS_KEY, 'resolved': self.resolved, 'learned': self.learned}
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2, sort_keys=True, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # The cache only saves work; resolution still succeeds without it
+            pass
+
+
+@functools.lru_cache(maxsize=None)
+def default_aliases(path=DEFAULT_ALIASES_PATH):
+    """Process-wide alias cache."""
+    return ModalityAliases(path)
+
+
+def normalize_modalities(modalities, aliases=None):
+    """
+    Vectorized normalize_modality: parameter abbreviation per label, or the label
+    itself where it isn't recognized. Each distinct label is resolved once.
+
+    Returns:
+    Series of normalized labels with the index of modalities
+    """
+    aliases = aliases or default_aliases()
+    if isinstance(modalities.dtype, pd.CategoricalDtype):
+        codes, labels = modalities.cat.codes.to_numpy(), modalities.cat.categories.astype(str)
+    else:
+        # Factorizing plain objects is faster than factorizing pandas string arrays
+        codes, labels = pd.factorize(modalities.astype(str).to_numpy(dtype=object))
+    labels = pd.Series(np.asarray(labels, dtype=object), dtype=object)
+    params = aliases.resolve(labels)
+    normalized = np.where(pd.isna(params), labels.to_numpy(dtype=object), params)
+    # Missing labels have code -1, which picks the trailing NaN
+    normalized = np.append(normalized, np.nan)
+    return pd.Series(normalized[codes], index=modalities.index, dtype=object)
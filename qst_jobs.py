@@ -0,0 +1,150 @@
+"""
+Background processing of uploaded workbooks.
+
+An UploadJob sends each workbook through parse -> template mapping -> scoring
+on a shared, bounded executor, so the app stays responsive while a batch of
+files is processed. The app polls the job for a per-file status table and
+fills in results as files complete. Cancelling drops queued files; a file
+that is already being parsed runs to completion, but its result is discarded.
+"""
+
+import io
+import os
+import time
+
+from qst_core import AnalysisCache
+from qst_metrics import finish_run, start_run
+from qst_norms import DEFAULT_NORM_SET, load_norm_set
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+
+# Used when no cache is passed in, e.g. in a worker process
+_analysis_cache = AnalysisCache()
+
+
+def process_workbook(name, data, gender, age, norm_set=DEFAULT_NORM_SET, templates=None, sheet_cache=None,
+                     analysis_cache=None):
+    """
+    Parse, map and score one workbook; runs on a worker thread or process.
+
+    Returns:
+    Dictionary with parameters, results, template (name of the matching mapping
+    template or None) and diagnostics. Raises ValueError when the workbook
+    can't be scored without manual mapping.
+    """
+    from qst_batch import find_summary_sheet
+    from qst_ingest import read_tables
+    from qst_templates import apply_area_mapping, match_template
+
+    start_run()
+    try:
+        diagnostics = []
+        workbook = io.BytesIO(data)
+        workbook.name = name
+        tables = read_tables(workbook, name, sheet_cache, diagnostics)
+        if not tables:
+            raise ValueError("; ".join(d.message for d in diagnostics) or "could not read file")
+
+        summary_df = find_summary_sheet(tables)
+        if summary_df is None:
+            raise ValueError("no summary table with Modality and Avg columns in a known export layout")
+
+        template, modality_area_map = match_template(templates or {}, summary_df)
+        parameters = apply_area_mapping(summary_df, modality_area_map)
+        if not parameters:
+            raise ValueError("no saved mapping template for this protocol; open the file to map body areas")
+
+        results = (analysis_cache or _analysis_cache).analyze(parameters, gender, age, load_norm_set(norm_set), diagnostics)
+        return {'parameters': parameters, 'results': results, 'template': template, 'diagnostics': diagnostics}
+    finally:
+        finish_run(stage='background_upload', file=name)
+
+
+class UploadItem:
+    __slots__ = ('name', 'data', 'gender', 'age', 'future', 'submitted', 'finished', 'cancelled')
+
+    def __init__(self, name, data, gender, age):
+        self.name = name
+        self.data = data
+        self.gender = gender
+        self.age = age
+        self.future = None
+        self.submitted = None
+        self.finished = None
+        self.cancelled = False
+
+    def _done(self, future):
+        self.finished = time.monotonic()
+
+    @property
+    def status(self):
+        future = self.future
+        if future is None:
+            return QUEUED
+        if future.done() and not future.cancelled() and not self.cancelled:
+            return FAILED if future.exception() is not None else DONE
+        if self.cancelled or future.cancelled():
+            return CANCELLED
+        return RUNNING if future.running() else QUEUED
+
+    @property
+    def output(self):
+        return self.future.result() if self.status == DONE else None
+
+    @property
+    def error(self):
+        return str(self.future.exception()) if self.status == FAILED else None
+
+
+class UploadJob:
+    def __init__(self, files):
+        """files is a list of (name, workbook bytes, gender, age)."""
+        self.items = [UploadItem(*f) for f in files]
+
+    def submit(self, executor, norm_set=DEFAULT_NORM_SET, templates=None, sheet_cache=None, analysis_cache=None):
+        for item in self.items:
+            item.submitted = time.monotonic()
+            item.future = executor.submit(
+                process_workbook, item.name, item.data, item.gender, item.age, norm_set, templates, sheet_cache,
+                analysis_cache
+            )
+            item.future.add_done_callback(item._done)
+            # The executor holds on to the bytes until the file is processed
+            item.data = None
+
+    def cancel(self):
+        for item in self.items:
+            if item.future is not None and not item.future.done():
+                item.future.cancel()
+                item.cancelled = True
+
+    @property
+    def running(self):
+        return any(item.status in (QUEUED, RUNNING) for item in self.items)
+
+    def completed(self):
+        return [item for item in self.items if item.status == DONE]
+
+    def rows(self):
+        """Per-file status rows for the progress table."""
+        rows = []
+        now = time.monotonic()
+        for item in self.items:
+            status = item.status
+            output = item.output
+            results = output['results'] if output else None
+            elapsed = (item.finished or now) - item.submitted if item.submitted is not None else None
+            rows.append({
+                'File': item.name,
+                'Patient': os.path.splitext(item.name)[0],
+                'Gender': item.gender,
+                'Age': item.age,
+                'Status': status,
+                'Seconds': round(elapsed, 1) if elapsed is not None and status != CANCELLED else None,
+                'Results': sum(len(areas) for areas in results.values()) if results else None,
+                'Abnormal': sum(
+                    not r.is_normal for areas in results.values() for r in areas.values()
+                ) if results else None,
+                'Message': item.error or (f"template '{output['template']}'" if output and output['template'] else '')
+            })
+        return rows
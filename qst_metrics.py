@@ -0,0 +1,160 @@
+"""
+Hot-path timers and counters.
+
+Each Streamlit rerun (or batch job) calls start_run() to get a fresh Metrics
+collector for its thread; timer() and increment() anywhere in the call stack
+record into it, and are no-ops when no run is active. finish_run() folds the
+run into process-wide totals and, when configured, appends it to a JSON-lines
+log (QST_METRICS_LOG) and rewrites a Prometheus textfile (QST_METRICS_PROM)
+for node_exporter's textfile collector.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_LOG_PATH = os.environ.get('QST_METRICS_LOG')
+METRICS_PROM_PATH = os.environ.get('QST_METRICS_PROM')
+
+
+class Metrics:
+    def __init__(self):
+        # stage -> [calls, total seconds, max seconds]
+        self.timers = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            entry = self.timers.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def increment(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other):
+        data = other.as_dict()
+        with self._lock:
+            for stage, t in data['timers'].items():
+                entry = self.timers.setdefault(stage, [0, 0.0, 0.0])
+                entry[0] += t['calls']
+                entry[1] += t['seconds']
+                entry[2] = max(entry[2], t['max_seconds'])
+            for name, n in data['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'timers': {
+                    stage: {'calls': calls, 'seconds': total, 'max_seconds': longest}
+                    for stage, (calls, total, longest) in self.timers.items()
+                },
+                'counters': dict(self.counters)
+            }
+
+
+_local = threading.local()
+_totals = Metrics()
+
+
+def current():
+    return getattr(_local, 'metrics', None)
+
+
+def start_run():
+    _local.metrics = Metrics()
+    return _local.metrics
+
+
+def finish_run(**labels):
+    """End the thread's run, add it to the process totals and write the configured logs."""
+    metrics = current()
+    _local.metrics = None
+    if metrics is None:
+        return None
+
+    _totals.merge(metrics)
+    if METRICS_LOG_PATH:
+        append_jsonl(METRICS_LOG_PATH, metrics, **labels)
+    if METRICS_PROM_PATH:
+        write_prometheus_textfile(METRICS_PROM_PATH, _totals)
+    return metrics
+
+
+def totals():
+    return _totals
+
+
+@contextmanager
+def timer(stage):
+    metrics = current()
+    if metrics is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    """Decorator form of timer()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def increment(name, n=1):
+    metrics = current()
+    if metrics is not None:
+        metrics.increment(name, n)
+
+
+def append_jsonl(path, metrics, **labels):
+    record = {'timestamp': time.time(), **labels, **metrics.as_dict()}
+    try:
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+    except OSError:
+        pass
+
+
+def write_prometheus_textfile(path, metrics):
+    data = metrics.as_dict()
+    lines = [
+        '# HELP qst_stage_seconds_total Time spent in each analyzer stage.',
+        '# TYPE qst_stage_seconds_total counter',
+    ]
+    lines += [f'qst_stage_seconds_total{{stage="{s}"}} {t["seconds"]:.6f}' for s, t in sorted(data['timers'].items())]
+    lines += [
+        '# HELP qst_stage_calls_total Number of times each analyzer stage ran.',
+        '# TYPE qst_stage_calls_total counter',
+    ]
+    lines += [f'qst_stage_calls_total{{stage="{s}"}} {t["calls"]}' for s, t in sorted(data['timers'].items())]
+    lines += [
+        '# HELP qst_events_total Analyzer event counters.',
+        '# TYPE qst_events_total counter',
+    ]
+    lines += [f'qst_events_total{{name="{n}"}} {v}' for n, v in sorted(data['counters'].items())]
+
+    # The textfile collector may read at any time, so replace the file atomically
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
@@ -0,0 +1,135 @@
+"""
+Versioned normative reference datasets.
+
+Each norm set is a CSV file in the norms directory (QST_NORMS_DIR, default
+./norms) with gender, age_group, parameter, area, mean and sd columns, listed
+in norms/index.json together with its version, description, log10-transformed
+parameters and the SHA-256 checksum of its values. Norm sets are validated and
+compiled once per process: limits and back-transformed display values are
+precomputed in the ReferenceTable, so scoring only indexes into arrays.
+"""
+
+import csv
+import functools
+import hashlib
+import json
+import math
+import os
+
+from qst_core import AGE_GROUPS, AREAS, GENDERS, LOG_TRANSFORMED_PARAMETERS, PARAMETERS
+
+NORMS_DIR = os.environ.get('QST_NORMS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'norms'))
+NORMS_INDEX = 'index.json'
+DEFAULT_NORM_SET = 'default'
+
+NORM_COLUMNS = ['gender', 'age_group', 'parameter', 'area', 'mean', 'sd']
+
+
+class NormSet:
+    def __init__(self, name, version, description, log_transformed, rows):
+        self.name = name
+        self.version = version
+        self.description = description
+        self.log_transformed = list(log_transformed)
+        self.rows = rows
+        self.checksum = values_checksum(rows)
+
+    @functools.cached_property
+    def reference_values(self):
+        """Nested {gender: {age_group: {parameter: {area: (mean, sd)}}}} dict, as used by analyze_qst_parameters."""
+        reference_values = {gender: {age_group: {} for age_group in AGE_GROUPS} for gender in GENDERS}
+        for gender, age_group, param, area, mean, sd in self.rows:
+            reference_values[gender][age_group].setdefault(param, {})[area] = (mean, sd)
+        return reference_values
+
+    @functools.cached_property
+    def table(self):
+        from qst_engine import compile_reference_table
+
+        return compile_reference_table(self.reference_values, self.log_transformed)
+
+    @property
+    def label(self):
+        return f"{self.name} v{self.version}"
+
+
+def values_checksum(rows):
+    # Hash the parsed values rather than the file bytes, so line endings and
+    # number formatting don't change the checksum
+    canonical = '\n'.join(','.join(map(repr, row)) for row in sorted(rows))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def read_norm_rows(path):
+    """Read and validate a norm set CSV, returning (gender, age_group, parameter, area, mean, sd) tuples."""
+    rows = []
+    seen = set()
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        missing = [col for col in NORM_COLUMNS if col not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"{path}: missing columns {', '.join(missing)}")
+
+        for line, record in enumerate(reader, start=2):
+            gender = record['gender'].strip().lower()
+            age_group = record['age_group'].strip()
+            param = record['parameter'].strip()
+            area = record['area'].strip().lower()
+
+            if gender not in GENDERS:
+                raise ValueError(f"{path}:{line}: unknown gender {gender!r}")
+            if age_group not in AGE_GROUPS:
+                raise ValueError(f"{path}:{line}: unknown age group {age_group!r}")
+            if param not in PARAMETERS:
+                raise ValueError(f"{path}:{line}: unknown parameter {param!r}")
+            if area not in AREAS:
+                raise ValueError(f"{path}:{line}: unknown body area {area!r}")
+
+            try:
+                mean = float(record['mean'])
+                sd = float(record['sd'])
+            except ValueError:
+                raise ValueError(f"{path}:{line}: mean and sd must be numbers")
+            if not math.isfinite(mean) or not math.isfinite(sd) or sd <= 0:
+                raise ValueError(f"{path}:{line}: mean must be finite and sd positive")
+
+            key = (gender, age_group, param, area)
+            if key in seen:
+                raise ValueError(f"{path}:{line}: duplicate entry for {', '.join(key)}")
+            seen.add(key)
+            rows.append(key + (mean, sd))
+
+    return rows
+
+
+def read_norms_index(norms_dir=NORMS_DIR):
+    with open(os.path.join(norms_dir, NORMS_INDEX)) as f:
+        return json.load(f)
+
+
+def available_norm_sets(norms_dir=NORMS_DIR):
+    return list(read_norms_index(norms_dir))
+
+
+@functools.lru_cache(maxsize=None)
+def load_norm_set(name=DEFAULT_NORM_SET, norms_dir=NORMS_DIR):
+    """Load, validate and checksum a norm set listed in the norms index. Cached per process."""
+    index = read_norms_index(norms_dir)
+    if name not in index:
+        raise ValueError(f"Unknown norm set {name!r} (available: {', '.join(index)})")
+
+    entry = index[name]
+    log_transformed = entry.get('log_transformed', LOG_TRANSFORMED_PARAMETERS)
+    unknown = [param for param in log_transformed if param not in PARAMETERS]
+    if unknown:
+        raise ValueError(f"Norm set {name!r}: unknown log-transformed parameters {', '.join(unknown)}")
+
+    rows = read_norm_rows(os.path.join(norms_dir, entry['file']))
+    norm_set = NormSet(name, str(entry.get('version', '')), entry.get('description', ''), log_transformed, rows)
+
+    expected = entry.get('sha256')
+    if expected and expected != norm_set.checksum:
+        raise ValueError(
+            f"Norm set {name!r}: checksum mismatch (index {expected[:12]}..., data {norm_set.checksum[:12]}...)"
+        )
+    return norm_set
@@ -0,0 +1,329 @@
+"""
+Patient reports.
+
+Renders analysis results into a self-contained HTML report (charts embedded as
+PNG data URIs) or a PDF (one page per parameter, drawn with matplotlib), with
+the same tables and comparison charts as the app.
+
+Usage (batch mode, on qst_batch.py output):
+    python qst_report.py qst_results.parquet -o reports/ --format html,pdf -j 8
+
+Reports are rendered across a process pool. Each worker loads the Jinja2
+template and warms matplotlib's font cache once, and reuses rendered charts
+by content, so a report only draws what is new.
+"""
+
+import argparse
+import base64
+import datetime
+import functools
+import io
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from qst_core import AREAS, QSTResult
+
+REPORT_TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'report_templates')
+REPORT_TEMPLATE = 'report.html'
+REPORT_FORMATS = ('html', 'pdf')
+
+# Rendered charts kept per process
+CHART_CACHE_MAX_ENTRIES = 256
+
+
+def result_table(param_results):
+    """Rows of one parameter's results table, as shown in the app and in reports."""
+    rows = []
+    for area in AREAS:
+        if area not in param_results:
+            continue
+        res = param_results[area]
+        status = "✅ Normal" if res.is_normal else "❌ Abnormal"
+
+        if res.log_transformed:
+            rows.append({
+                "Body Area": area.capitalize(),
+                "Patient Value": f"{res.patient_value:.2f}",
+                "Reference Mean": f"{res.display_mean:.2f} (log10: {res.reference_mean:.2f})",
+                "Reference SD": f"{res.reference_sd:.2f} (in log10 space)",
+                "Normal Range": f"{res.display_lower:.2f} to {res.display_upper:.2f}",
+                "Status": status
+            })
+        else:
+            rows.append({
+                "Body Area": area.capitalize(),
+                "Patient Value": f"{res.patient_value:.2f}",
+                "Reference Mean": f"{res.reference_mean:.2f}",
+                "Reference SD": f"{res.reference_sd:.2f}",
+                "Normal Range": f"{res.lower_limit:.2f} to {res.upper_limit:.2f}",
+                "Status": status
+            })
+    return rows
+
+
+def is_log_transformed(param_results):
+    return any(param_results[area].log_transformed for area in param_results if area in AREAS)
+
+
+def chart_series(param_results, is_log_transformed):
+    """Areas, patient values, reference means and normal limits of one parameter's chart, in body area order."""
+    areas, patient_values, ref_means, lower_limits, upper_limits = [], [], [], [], []
+
+    for area in AREAS:
+        if area in param_results:
+            res = param_results[area]
+            areas.append(area.capitalize())
+            patient_values.append(res.patient_value)
+
+            if is_log_transformed:
+                ref_means.append(res.display_mean)
+                lower_limits.append(res.display_lower)
+                upper_limits.append(res.display_upper)
+            else:
+                ref_means.append(res.reference_mean)
+                lower_limits.append(res.lower_limit)
+                upper_limits.append(res.upper_limit)
+
+    return tuple(areas), tuple(patient_values), tuple(ref_means), tuple(lower_limits), tuple(upper_limits)
+
+
+def draw_comparison(ax, param, areas, patient_values, ref_means, lower_limits, upper_limits):
+    """Patient values against reference means with normal-range whiskers."""
+    import numpy as np
+
+    x = np.arange(len(areas))
+    width = 0.35
+
+    ax.bar(x, patient_values, width, label='Patient Value', color='lightcoral')
+    ax.bar(x + width, ref_means, width, label='Reference Mean', color='lightblue')
+
+    for i, (lower, upper, mean) in enumerate(zip(lower_limits, upper_limits, ref_means)):
+        ax.plot([i + width, i + width], [lower, upper], color='blue', linestyle='-', linewidth=2)
+        ax.plot([i + width - 0.1, i + width + 0.1], [lower, lower], color='blue', linestyle='-', linewidth=2)
+        ax.plot([i + width - 0.1, i + width + 0.1], [upper, upper], color='blue', linestyle='-', linewidth=2)
+
+    ax.set_ylabel('Value')
+    ax.set_title(f'{param} Comparison')
+    ax.set_xticks(x + width / 2)
+    ax.set_xticklabels(areas)
+    ax.legend()
+
+
+def comparison_png(param, areas, patient_values, ref_means, lower_limits, upper_limits):
+    # A bare Figure is not registered with pyplot, so it is freed with the last reference
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 4))
+    # Fixed margins: bbox_inches='tight' would lay out and draw the figure twice
+    fig.subplots_adjust(left=0.07, right=0.98, bottom=0.1, top=0.9)
+    draw_comparison(fig.subplots(), param, areas, patient_values, ref_means, lower_limits, upper_limits)
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=100)
+    fig.clear()
+    return buf.getvalue()
+
+
+_cached_comparison_png = functools.lru_cache(maxsize=CHART_CACHE_MAX_ENTRIES)(comparison_png)
+
+
+@functools.lru_cache(maxsize=None)
+def report_template(templates_dir=REPORT_TEMPLATES_DIR, name=REPORT_TEMPLATE):
+    """Compiled Jinja2 report template, loaded once per process."""
+    import jinja2
+
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(templates_dir), autoescape=jinja2.select_autoescape(['html'])
+    )
+    return env.get_template(name)
+
+
+def warm_worker():
+    """Load the report template and matplotlib's fonts before the first report."""
+    from matplotlib import font_manager
+
+    report_template()
+    font_manager.findfont('DejaVu Sans')
+
+
+def report_sections(results):
+    sections = []
+    for param, param_results in results.items():
+        log_transformed = is_log_transformed(param_results)
+        rows = result_table(param_results)
+        if not rows:
+            continue
+        sections.append({
+            'parameter': param,
+            'log_transformed': log_transformed,
+            'rows': rows,
+            'series': chart_series(param_results, log_transformed),
+            'abnormal': sum(not r.is_normal for area, r in param_results.items() if area in AREAS)
+        })
+    return sections
+
+
+def render_html(patient, results):
+    """
+    Self-contained HTML report.
+
+    patient is a dict with patient_id, gender, age and optionally visit_date and norm_set.
+    """
+    sections = report_sections(results)
+    for section in sections:
+        png = _cached_comparison_png(section['parameter'], *section['series'])
+        section['chart'] = 'data:image/png;base64,' + base64.b64encode(png).decode('ascii')
+
+    return report_template().render(
+        patient=patient,
+        sections=sections,
+        columns=list(sections[0]['rows'][0]) if sections else [],
+        generated=datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
+    )
+
+
+def render_pdf(patient, results):
+    """PDF report with one page per parameter: heading, results table and comparison chart."""
+    from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.figure import Figure
+
+    heading = (
+        f"QST Thermal Parameters Report - {patient['patient_id']}\n"
+        f"{patient['gender'].capitalize()}, age {patient['age']}"
+        + (f", visit {patient['visit_date']}" if patient.get('visit_date') else '')
+        + (f" - norms: {patient['norm_set']}" if patient.get('norm_set') else '')
+    )
+
+    buf = io.BytesIO()
+    with PdfPages(buf) as pdf:
+        for section in report_sections(results):
+            fig = Figure(figsize=(8.27, 11.69))
+            fig.suptitle(heading, fontsize=11, x=0.05, ha='left')
+            table_ax, chart_ax = fig.subplots(2, 1, gridspec_kw={'height_ratios': [1, 2]})
+
+            table_ax.axis('off')
+            table_ax.set_title(f"{section['parameter']} Results", loc='left')
+            columns = list(section['rows'][0])
+            # The PDF core fonts lack the emoji used by the app's status column
+            cells = [[row[c].lstrip('✅❌ ') for c in columns] for row in section['rows']]
+            table = table_ax.table(cellText=cells, colLabels=columns, loc='upper center', cellLoc='left')
+            table.auto_set_font_size(False)
+            table.set_fontsize(7)
+            table.scale(1, 1.4)
+            if section['log_transformed']:
+                table_ax.text(0, 0.05, f"{section['parameter']} is log10-transformed in the normative reference data.",
+                              fontsize=8, transform=table_ax.transAxes)
+
+            draw_comparison(chart_ax, section['parameter'], *section['series'])
+            pdf.savefig(fig)
+            fig.clear()
+    return buf.getvalue()
+
+
+def write_report(patient, results, path):
+    """Write an HTML or PDF report, chosen by the file extension."""
+    if path.endswith('.pdf'):
+        data = render_pdf(patient, results)
+    else:
+        data = render_html(patient, results).encode('utf-8')
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def results_from_frame(df):
+    """
+    Rebuild per-patient analysis results from qst_batch output.
+
+    Returns:
+    List of (patient dict, results dict), as used by write_report
+    """
+    from qst_store import SCORED_STATUSES
+
+    reports = []
+    df = df[df['status'].isin(SCORED_STATUSES)]
+    for patient_id, rows in df.groupby('patient_id', sort=True, observed=True):
+        first = rows.iloc[0]
+        patient = {'patient_id': str(patient_id), 'gender': first['gender'], 'age': int(first['age'])}
+        if 'visit_date' in rows.columns:
+            patient['visit_date'] = str(first['visit_date'])
+        if 'norm_set' in rows.columns:
+            patient['norm_set'] = first['norm_set']
+
+        results = {}
+        for row in rows.itertuples(index=False):
+            results.setdefault(row.parameter, {})[row.area] = QSTResult.from_scored(row)
+        reports.append((patient, results))
+    return reports
+
+
+def _write_reports(task):
+    patient, results, paths = task
+    try:
+        return [write_report(patient, results, path) for path in paths], None
+    except Exception as e:
+        return [], f"{patient['patient_id']}: {e}"
+
+
+def generate_reports(reports, out_dir, formats=('html',), workers=None):
+    """
+    Write a report per patient in each format across a process pool.
+
+    Returns:
+    Tuple of (written paths, list of errors)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = [
+        (patient, results, [os.path.join(out_dir, f"{patient['patient_id']}.{fmt}") for fmt in formats])
+        for patient, results in reports
+    ]
+    if not tasks:
+        return [], []
+
+    workers = workers or os.cpu_count() or 1
+    written = []
+    errors = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_worker) as pool:
+        # Chunks amortize the round trips; each worker still sees enough reports to reuse its caches
+        chunksize = max(1, len(tasks) // (workers * 4))
+        for paths, error in pool.map(_write_reports, tasks, chunksize=chunksize):
+            written.extend(paths)
+            if error:
+                errors.append(error)
+    return written, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write patient reports from qst_batch.py results.")
+    parser.add_argument('results', help="qst_batch.py output (.csv or .parquet)")
+    parser.add_argument('-o', '--output-dir', default='reports', help="Directory for the reports")
+    parser.add_argument('--format', default='html', help="Comma-separated report formats: html, pdf")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    formats = [fmt.strip().lower() for fmt in args.format.split(',') if fmt.strip()]
+    unknown = [fmt for fmt in formats if fmt not in REPORT_FORMATS]
+    if unknown:
+        parser.error(f"unknown report format: {', '.join(unknown)}")
+
+    import pandas as pd
+
+    if args.results.endswith('.parquet'):
+        df = pd.read_parquet(args.results)
+    else:
+        # Patient IDs and visit dates as written: "001" must not become 1
+        df = pd.read_csv(args.results, dtype={'patient_id': str, 'visit_date': str})
+    written, errors = generate_reports(results_from_frame(df), args.output_dir, formats, args.workers)
+
+    for error in errors:
+        print(error, file=sys.stderr)
+    print(f"Wrote {len(written)} reports to {args.output_dir}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""
+Local HTTP/JSON scoring service.
+
+Scores QST thresholds for other systems, such as an EHR integration, without
+going through the Streamlit UI:
+
+    python qst_service.py [--host 127.0.0.1] [--port 8765] [--norms default,...]
+
+Endpoints:
+    GET  /health           {"status": "ok", "norm_sets": ["default v1", ...]}
+    GET  /age-group?age=45 {"age": 45.0, "age_group": "40-50"}
+    POST /score            scores a batch of patients
+
+A /score request names an optional norm set and any number of patients:
+    {"norm_set": "default",
+     "patients": [{"patient_id": "P001", "gender": "female", "age": 45,
+                   "parameters": {"CDT_face": 1.2, "HPT_hand": 44.1}}, ...]}
+
+The response has one entry per patient, in request order. results is null
+when the patient could not be scored; diagnostics explain why, and warn about
+individual parameters that were skipped:
+    {"norm_set": "default v1",
+     "patients": [{"patient_id": "P001", "age_group": "40-50",
+                   "results": {"CDT": {"face": {"patient_value": 1.2, "reference_mean": ..., "is_normal": true}}},
+                   "diagnostics": [{"level": "warning", "message": "..."}]}]}
+
+Norm sets are loaded and compiled when the service starts and stay in memory,
+and each batch is scored in one vectorized pass (qst_core.score_cells). The service has
+no authentication and listens on localhost unless told otherwise.
+"""
+
+import argparse
+import json
+import math
+import sys
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from qst_core import GENDERS, Diagnostic, assemble_results, get_age_group, score_cells
+from qst_metrics import finish_run, start_run, timed
+from qst_norms import DEFAULT_NORM_SET, available_norm_sets, load_norm_set
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Largest accepted request body, and patients per /score request
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+MAX_BATCH_PATIENTS = 10000
+
+
+class RequestError(ValueError):
+    """A malformed request; reported to the client as HTTP 400."""
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _json_value(value):
+    # JSON has no NaN; results of unparseable values carry it, and json.loads
+    # accepts it in requests
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def result_json(results):
+    """{parameter: {area: QSTResult}} as plain JSON objects."""
+    if results is None:
+        return None
+    return {
+        param: {area: {k: _json_value(v) for k, v in r._asdict().items()} for area, r in areas.items()}
+        for param, areas in results.items()
+    }
+
+
+def read_patient(patient):
+    """
+    Validate one patient of a /score request.
+
+    Returns:
+    Tuple of (patient_id, gender, age, parameters, list of Diagnostic); gender
+    and age are None when they can't be scored
+    """
+    if not isinstance(patient, dict):
+        raise RequestError("each patient must be a JSON object")
+
+    diagnostics = []
+    gender = patient.get('gender')
+    gender = gender.strip().lower() if isinstance(gender, str) else gender
+    if gender not in GENDERS:
+        diagnostics.append(Diagnostic('error', f"Unknown gender: {gender}"))
+        gender = None
+
+    age = patient.get('age')
+    if not _number(age):
+        diagnostics.append(Diagnostic('error', f"Age must be a number, got {age!r}"))
+        age = None
+    elif not get_age_group(age):
+        diagnostics.append(Diagnostic('error', "Age must be at least 20 years."))
+        age = None
+
+    parameters = patient.get('parameters', {})
+    if not isinstance(parameters, dict):
+        raise RequestError("parameters must be an object of \"<parameter>_<area>\": value")
+    return patient.get('patient_id'), gender, age, parameters, diagnostics
+
+
+@timed('service_score')
+def score_patients(patients, norm_set):
+    """
+    Score a batch of patients (dicts as in a /score request) in one vectorized pass.
+
+    Returns:
+    List of response entries, in the order of patients
+    """
+    requests = [read_patient(patient) for patient in patients]
+
+    keys = []
+    measurements = []
+    cells = [{} for _ in requests]
+    for i, (_, gender, age, parameters, diagnostics) in enumerate(requests):
+        if gender is None or age is None:
+            continue
+        for param_area, value in parameters.items():
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                number = math.nan
+            if not math.isfinite(number):
+                message = f"Value of {param_area} must be a number, got {value!r}"
+                cells[i][param_area] = (None, None, None, [Diagnostic('warning', message)])
+                continue
+            keys.append((i, param_area))
+            measurements.append((gender, age, param_area, value))
+
+    # The whole batch is scored in one pass
+    for (i, param_area), cell in zip(keys, score_cells(measurements, norm_set.table)):
+        cells[i][param_area] = cell
+
+    entries = []
+    for (patient_id, gender, age, parameters, diagnostics), patient_cells in zip(requests, cells):
+        results = None
+        if gender is not None and age is not None:
+            results = assemble_results([patient_cells[param_area] for param_area in parameters], diagnostics)
+        entries.append({
+            'patient_id': _json_value(patient_id),
+            'age_group': get_age_group(age) if age is not None else None,
+            'results': result_json(results),
+            'diagnostics': [d._asdict() for d in diagnostics]
+        })
+    return entries
+
+
+def score_request(body, norm_sets):
+    """Handle a decoded /score request body; norm_sets maps names to loaded norm sets."""
+    if not isinstance(body, dict) or not isinstance(body.get('patients'), list):
+        raise RequestError("request must be an object with a \"patients\" list")
+    if len(body['patients']) > MAX_BATCH_PATIENTS:
+        raise RequestError(f"at most {MAX_BATCH_PATIENTS} patients per request")
+
+    name = body.get('norm_set', DEFAULT_NORM_SET)
+    if name not in norm_sets:
+        raise RequestError(f"unknown norm set {name!r} (available: {', '.join(norm_sets)})")
+
+    norm_set = norm_sets[name]
+    return {'norm_set': norm_set.label, 'patients': score_patients(body['patients'], norm_set)}
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    # Keep-alive lets a client send many batches over one connection
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; with Nagle's algorithm on, the
+    # body would wait for the client's delayed ACK (~40 ms) on every response
+    disable_nagle_algorithm = True
+    server_version = 'QSTScoring/1'
+
+    def _send_json(self, status, data):
+        try:
+            payload = json.dumps(data, allow_nan=False).encode('utf-8')
+        except (TypeError, ValueError) as e:
+            # Still answer, so a client never waits on a dropped connection
+            status = 500
+            payload = json.dumps({'error': f"response is not valid JSON: {e}"}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status, message):
+        self._send_json(status, {'error': message})
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/health':
+            self._send_json(200, {'status': 'ok', 'norm_sets': [n.label for n in self.server.norm_sets.values()]})
+        elif url.path == '/age-group':
+            age = urllib.parse.parse_qs(url.query).get('age', [''])[0]
+            try:
+                age = float(age)
+            except ValueError:
+                age = math.nan
+            if not math.isfinite(age):
+                return self._send_error(400, "age must be a finite number")
+            self._send_json(200, {'age': age, 'age_group': get_age_group(age)})
+        else:
+            self._send_error(404, f"no such endpoint: {url.path}")
+
+    def do_POST(self):
+        if urllib.parse.urlsplit(self.path).path != '/score':
+            return self._send_error(404, f"no such endpoint: {self.path}")
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            self.close_connection = True
+            return self._send_error(400, "invalid Content-Length")
+        if length > MAX_REQUEST_BYTES:
+            # The body is left unread, so the connection can't be reused
+            self.close_connection = True
+            return self._send_error(413, f"request body over {MAX_REQUEST_BYTES} bytes")
+
+        start_run()
+        try:
+            body = json.loads(self.rfile.read(length) or b'null')
+            response = score_request(body, self.server.norm_sets)
+        except ValueError as e:
+            # RequestError, and json.JSONDecodeError for a body that isn't JSON
+            return self._send_error(400, str(e))
+        except Exception as e:
+            return self._send_error(500, f"{type(e).__name__}: {e}")
+        finally:
+            finish_run(stage='service_request')
+        self._send_json(200, response)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ScoringServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections when several clients connect
+    # at once, and a dropped SYN costs the client a 1 s retransmit
+    request_queue_size = 128
+
+    def __init__(self, address, norm_set_names=None, verbose=False):
+        # Load and compile every norm set up front, so no request pays for it
+        self.norm_sets = {name: load_norm_set(name) for name in (norm_set_names or available_norm_sets())}
+        for norm_set in self.norm_sets.values():
+            norm_set.table  # compiled once and kept on the norm set
+        self.verbose = verbose
+        super().__init__(address, ScoringHandler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve QST scoring over HTTP/JSON.")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="Interface to listen on (default: localhost only)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--norms', help="Comma-separated norm sets to serve (default: all in the norms index)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Log every request")
+    args = parser.parse_args(argv)
+
+    names = [n.strip() for n in args.norms.split(',') if n.strip()] if args.norms else None
+    server = ScoringServer((args.host, args.port), names, args.verbose)
+    host, port = server.server_address[:2]
+    print(f"Serving QST scoring on http://{host}:{port} (norm sets: {', '.join(server.norm_sets)})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
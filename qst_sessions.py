@@ -0,0 +1,184 @@
+"""
+Per-session memory accounting for the app.
+
+Uploaded files are moved out of the file uploader into a SessionUploads store
+that is bounded by a per-session budget (QST_SESSION_MEMORY_MB, default 256 MB).
+Files scored in the background are dropped as soon as they are done; the file
+analyzed in the app is kept, so its body-area mapping can still be changed,
+until the next files are uploaded. After every rerun each session reports its
+memory use to the process-wide SessionRegistry, which backs the admin view.
+
+Norm sets, parsed sheets, rendered charts and analysis results are shared
+read-only by all sessions through process-wide caches, so they are reported
+once for the process rather than per session.
+"""
+
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+SESSION_MEMORY_BUDGET = int(float(os.environ.get('QST_SESSION_MEMORY_MB', 256)) * 1024 ** 2)
+
+# Sessions that haven't rerun for this long are dropped from the registry
+SESSION_IDLE_SECONDS = 3600
+
+# Nesting followed by deep_size; deeper objects are counted shallowly
+MAX_SIZE_DEPTH = 8
+
+
+def deep_size(obj, seen=None, depth=0):
+    """Approximate memory held by obj and what it references, counting shared objects once."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool, type(None))):
+        return sys.getsizeof(obj)
+    if hasattr(obj, 'memory_usage') and hasattr(obj, 'dtypes'):
+        # DataFrame or Series
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, 'sum') else usage)
+    if hasattr(obj, 'nbytes') and hasattr(obj, 'dtype'):
+        return int(obj.nbytes)
+
+    size = sys.getsizeof(obj)
+    if depth >= MAX_SIZE_DEPTH:
+        return size
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen, depth + 1) + deep_size(v, seen, depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen, depth + 1) for item in obj)
+    else:
+        if hasattr(obj, '__dict__'):
+            size += deep_size(vars(obj), seen, depth + 1)
+        for slot in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, slot):
+                size += deep_size(getattr(obj, slot), seen, depth + 1)
+    return size
+
+
+def process_memory():
+    """Resident memory of this process in bytes, or None where it can't be read."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+
+        # Peak rather than current resident memory; kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+class StoredUpload:
+    """An uploaded file held by the session; has the name and getvalue() of a Streamlit UploadedFile."""
+    __slots__ = ('name', 'data', 'content_hash')
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+        self.content_hash = hashlib.sha256(data).hexdigest()
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def getvalue(self):
+        return self.data
+
+
+class SessionUploads:
+    """Uploaded files of one session by name, bounded by the session's memory budget."""
+
+    def __init__(self, budget=SESSION_MEMORY_BUDGET):
+        self.budget = budget
+        self._files = OrderedDict()
+
+    def add(self, name, data, other_bytes=0):
+        """
+        Keep an uploaded file, replacing one with the same name.
+
+        other_bytes is the rest of the session's memory use. Raises ValueError
+        when the file doesn't fit in the budget.
+        """
+        previous = self._files.get(name)
+        used = self.nbytes - (previous.size if previous else 0) + other_bytes
+        if used + len(data) > self.budget:
+            raise ValueError(
+                f"{name} ({len(data) / 1024 ** 2:.1f} MB) doesn't fit in this session's memory budget: "
+                f"{used / 1024 ** 2:.1f} of {self.budget / 1024 ** 2:.0f} MB in use. "
+                "Score or remove some files first."
+            )
+        self._files[name] = StoredUpload(name, data)
+        return self._files[name]
+
+    def evict(self, name):
+        return self._files.pop(name, None) is not None
+
+    def get(self, name):
+        return self._files.get(name)
+
+    def names(self):
+        return list(self._files)
+
+    def files(self):
+        return list(self._files.values())
+
+    def __len__(self):
+        return len(self._files)
+
+    @property
+    def nbytes(self):
+        return sum(f.size for f in self._files.values())
+
+
+class SessionUsage(NamedTuple):
+    session_id: str
+    uploads: int
+    upload_bytes: int
+    state_bytes: int
+    budget: int
+    updated: float
+
+    @property
+    def total_bytes(self):
+        return self.upload_bytes + self.state_bytes
+
+
+class SessionRegistry:
+    """Latest memory use reported by each session of the process."""
+
+    def __init__(self, idle_seconds=SESSION_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def update(self, usage):
+        with self._lock:
+            self._sessions[usage.session_id] = usage
+
+    def remove(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def snapshot(self, is_active=None):
+        """
+        Usage of the live sessions, largest first. Sessions idle for longer than
+        idle_seconds, or for which is_active(session_id) is False, are dropped.
+        """
+        cutoff = time.time() - self.idle_seconds
+        with self._lock:
+            for session_id, usage in list(self._sessions.items()):
+                if usage.updated < cutoff or (is_active is not None and not is_active(session_id)):
+                    del self._sessions[session_id]
+            sessions = list(self._sessions.values())
+        return sorted(sessions, key=lambda usage: usage.total_bytes, reverse=True)
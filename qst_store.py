@@ -0,0 +1,197 @@
+"""
+Longitudinal store of analysis results.
+
+Scored results are kept in a local SQLite database (QST_STORE_PATH, default
+~/.local/share/qst_analyzer/results.sqlite), one row per patient, visit date,
+parameter, area and norm set, so a patient's earlier visits can be compared
+without re-reading their workbooks. Saving the same visit again replaces its
+rows. The unique key doubles as the index for per-patient trends, and a
+covering (parameter, area, visit_date, is_normal) index answers cohort
+abnormality rates without touching the table.
+"""
+
+import datetime
+import math
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+
+DEFAULT_STORE_PATH = os.environ.get(
+    'QST_STORE_PATH',
+    os.path.join(os.path.expanduser('~'), '.local', 'share', 'qst_analyzer', 'results.sqlite')
+)
+
+# Bump together with a migration in _create_schema when the table changes
+SCHEMA_VERSION = 1
+
+STORE_COLUMNS = [
+    'patient_id', 'visit_date', 'gender', 'age', 'parameter', 'area', 'patient_value',
+    'reference_mean', 'reference_sd', 'lower_limit', 'upper_limit', 'z_score',
+    'log_transformed', 'is_normal', 'norm_set', 'source'
+]
+
+# Batch rows that analyze_qst_parameters would also have reported as results
+SCORED_STATUSES = ('ok', 'non_positive_log_value')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    patient_id TEXT NOT NULL,
+    visit_date TEXT NOT NULL,
+    gender TEXT NOT NULL,
+    age INTEGER NOT NULL,
+    parameter TEXT NOT NULL,
+    area TEXT NOT NULL,
+    patient_value REAL,
+    reference_mean REAL,
+    reference_sd REAL,
+    lower_limit REAL,
+    upper_limit REAL,
+    z_score REAL,
+    log_transformed INTEGER NOT NULL,
+    is_normal INTEGER NOT NULL,
+    norm_set TEXT NOT NULL,
+    source TEXT,
+    UNIQUE (patient_id, parameter, area, visit_date, norm_set)
+);
+CREATE INDEX IF NOT EXISTS results_cohort ON results (parameter, area, visit_date, is_normal);
+"""
+
+
+def iso_date(value):
+    """Normalize a date, datetime, Timestamp or 'YYYY-MM-DD...' string to 'YYYY-MM-DD'."""
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return datetime.date.fromisoformat(str(value).strip()[:10]).isoformat()
+
+
+def _real(value):
+    if value is None:
+        return None
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def result_rows(patient_id, visit_date, gender, age, results, norm_set, source=None):
+    """Flatten analyze_qst_parameters results into store rows (z_score is left empty)."""
+    visit_date = iso_date(visit_date)
+    return [
+        (
+            str(patient_id), visit_date, gender, int(age), param, area, _real(r.patient_value),
+            _real(r.reference_mean), _real(r.reference_sd), _real(r.lower_limit), _real(r.upper_limit),
+            None, int(r.log_transformed), int(r.is_normal), norm_set, source
+        )
+        for param, areas in results.items()
+        for area, r in areas.items()
+    ]
+
+
+def frame_rows(df, visit_date=None):
+    """
+    Convert qst_batch results into store rows.
+
+    The visit date comes from a visit_date column when present, otherwise from
+    the visit_date argument (default: today) for rows without one.
+    """
+    default_date = iso_date(visit_date or datetime.date.today())
+    if 'visit_date' in df.columns:
+        dates = df['visit_date'].fillna(default_date).map(iso_date)
+    else:
+        dates = [default_date] * len(df)
+    return [
+        (
+            str(row.patient_id), date, row.gender, int(row.age), row.parameter, row.area, _real(row.value),
+            _real(row.reference_mean), _real(row.reference_sd), _real(row.lower_limit), _real(row.upper_limit),
+            _real(row.z_score), int(row.log_transformed), int(row.is_normal), row.norm_set, row.file
+        )
+        for row, date in zip(df.itertuples(index=False), dates)
+        if row.status in SCORED_STATUSES
+    ]
+
+
+class ResultsStore:
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.connect() as conn:
+            self._create_schema(conn)
+
+    @contextmanager
+    def connect(self):
+        # One short-lived connection per operation keeps the store usable from
+        # any thread or process; WAL lets readers run alongside a bulk insert
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            yield conn
+
+    def _create_schema(self, conn):
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise ValueError(f"{self.path}: results store schema v{version} is newer than this analyzer (v{SCHEMA_VERSION})")
+        with conn:
+            conn.executescript(SCHEMA)
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def insert_rows(self, rows):
+        """Insert or replace rows (tuples in STORE_COLUMNS order) in a single transaction."""
+        placeholders = ', '.join('?' * len(STORE_COLUMNS))
+        with self.connect() as conn, conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO results ({', '.join(STORE_COLUMNS)}) VALUES ({placeholders})", rows
+            )
+        return len(rows)
+
+    def save_results(self, patient_id, visit_date, gender, age, results, norm_set, source=None):
+        return self.insert_rows(result_rows(patient_id, visit_date, gender, age, results, norm_set, source))
+
+    def save_frame(self, df, visit_date=None):
+        return self.insert_rows(frame_rows(df, visit_date))
+
+    def _query(self, sql, params=()):
+        import pandas as pd
+
+        with self.connect() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def patient_ids(self):
+        with self.connect() as conn:
+            return [row[0] for row in conn.execute('SELECT DISTINCT patient_id FROM results ORDER BY patient_id')]
+
+    def patient_trend(self, patient_id, parameter=None, area=None, norm_set=None):
+        """Every stored result for one patient, ordered by parameter, area and visit date."""
+        sql = ("SELECT visit_date, gender, age, parameter, area, patient_value, reference_mean, lower_limit, "
+               "upper_limit, z_score, log_transformed, is_normal, norm_set FROM results WHERE patient_id = ?")
+        params = [str(patient_id)]
+        for column, value in (('parameter', parameter), ('area', area), ('norm_set', norm_set)):
+            if value is not None:
+                sql += f" AND {column} = ?"
+                params.append(value)
+        df = self._query(sql + " ORDER BY parameter, area, visit_date", params)
+        return df.astype({'log_transformed': bool, 'is_normal': bool})
+
+    def cohort_abnormality_rates(self, parameter=None, area=None, start=None, end=None):
+        """
+        Share of abnormal results per parameter and area, optionally limited to
+        visits between start and end (inclusive).
+
+        Returns:
+        DataFrame with parameter, area, results, abnormal and abnormal_rate columns
+        """
+        conditions = []
+        params = []
+        for column, op, value in (('parameter', '=', parameter), ('area', '=', area),
+                                  ('visit_date', '>=', start), ('visit_date', '<=', end)):
+            if value is not None:
+                conditions.append(f"{column} {op} ?")
+                params.append(iso_date(value) if column == 'visit_date' else value)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        df = self._query(
+            f"SELECT parameter, area, COUNT(*) AS results, SUM(is_normal = 0) AS abnormal FROM results {where} "
+            "GROUP BY parameter, area ORDER BY parameter, area",
+            params
+        )
+        df['abnormal_rate'] = df['abnormal'] / df['results']
+        return df
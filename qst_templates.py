@@ -0,0 +1,162 @@
+"""
+Saved body-area mapping templates.
+
+A protocol runs the same Sequence -> body area layout every time, so once a
+mapping has been chosen it is saved under a name together with the protocol
+signature: the sorted (normalized modality, Sequence) pairs of the summary
+sheet's QST tests. On the next upload of the same protocol the mapping is
+matched by signature and applied to the summary sheet in a single join. For
+other protocols, areas that saved templates give the same (modality, Sequence)
+are only suggested, since another protocol may reuse the Sequence numbers.
+
+Templates are stored as JSON:
+    {"<name>": {"signature": "<hex>", "mapping": {"CDT|1": "face", ...}}}
+"""
+
+import hashlib
+import json
+import os
+
+from qst_core import PARAMETERS
+
+DEFAULT_TEMPLATES_PATH = os.environ.get(
+    'QST_TEMPLATES_PATH',
+    os.path.join(os.path.expanduser('~'), '.config', 'qst_analyzer', 'mapping_templates.json')
+)
+
+
+def sequence_key(sequence):
+    # Excel may hand back 1, 1.0 or '1' for the same Sequence
+    if isinstance(sequence, float) and sequence.is_integer():
+        sequence = int(sequence)
+    return str(sequence).strip()
+
+
+def _mapping_key(modality, sequence):
+    return f"{modality}|{sequence_key(sequence)}"
+
+
+def qst_tests(summary_df):
+    """Return (normalized modality, Sequence) for the summary rows that are QST tests, in sheet order."""
+    from qst_ingest import normalize_modalities
+
+    normalized = normalize_modalities(summary_df['Modality'])
+    return [
+        (modality, sequence)
+        for modality, sequence in zip(normalized, summary_df['Sequence'])
+        if modality in PARAMETERS
+    ]
+
+
+def protocol_signature(summary_df):
+    keys = sorted(set(_mapping_key(m, s) for m, s in qst_tests(summary_df)))
+    return hashlib.sha1('\n'.join(keys).encode()).hexdigest()
+
+
+def load_templates(path=DEFAULT_TEMPLATES_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_template(name, summary_df, modality_area_map, path=DEFAULT_TEMPLATES_PATH):
+    """Save a {(modality, sequence): area} mapping as a template for this summary sheet's protocol."""
+    templates = load_templates(path)
+    templates[name] = {
+        'signature': protocol_signature(summary_df),
+        'mapping': {_mapping_key(m, s): area for (m, s), area in modality_area_map.items()}
+    }
+    _write_templates(templates, path)
+
+
+def delete_template(name, path=DEFAULT_TEMPLATES_PATH):
+    templates = load_templates(path)
+    if templates.pop(name, None) is not None:
+        _write_templates(templates, path)
+
+
+def _write_templates(templates, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(templates, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def match_template(templates, summary_df):
+    """
+    Find the saved template for the summary sheet's protocol.
+
+    Only a template whose signature matches the sheet exactly is applied; see
+    suggest_areas for sheets of other protocols.
+
+    Returns:
+    Tuple of (name of the matching template or None, {(modality, sequence): area})
+    """
+    tests = qst_tests(summary_df)
+    if not templates or not tests:
+        return None, {}
+
+    signature = protocol_signature(summary_df)
+    for name, template in templates.items():
+        if template.get('signature') == signature:
+            mapping = template['mapping']
+            return name, {
+                (m, s): mapping[_mapping_key(m, s)] for m, s in tests if _mapping_key(m, s) in mapping
+            }
+    return None, {}
+
+
+def suggest_areas(templates, summary_df):
+    """
+    Areas for the summary sheet's QST tests from the first template that maps the
+    same (modality, Sequence), whatever its protocol. These are suggestions to be
+    confirmed, never applied as they are.
+
+    Returns:
+    Dictionary of (modality, sequence) -> area
+    """
+    if not templates:
+        return {}
+
+    modality_area_map = {}
+    for m, s in qst_tests(summary_df):
+        key = _mapping_key(m, s)
+        for template in templates.values():
+            if key in template.get('mapping', {}):
+                modality_area_map[(m, s)] = template['mapping'][key]
+                break
+    return modality_area_map
+
+
+def apply_area_mapping(summary_df, modality_area_map):
+    """
+    Look up the Avg of every mapped test with one join against the summary sheet.
+
+    Returns:
+    Dictionary of "<modality>_<area>" -> Avg, as used by analyze_qst_parameters
+    """
+    if not modality_area_map:
+        return {}
+
+    import pandas as pd
+
+    from qst_ingest import normalize_modalities
+
+    mapping_df = pd.DataFrame(
+        [(m, sequence_key(s), area) for (m, s), area in modality_area_map.items()],
+        columns=['Normalized_Modality', 'Sequence_key', 'area']
+    )
+    tests = pd.DataFrame({
+        'Normalized_Modality': normalize_modalities(summary_df['Modality']),
+        'Sequence_key': summary_df['Sequence'].map(sequence_key),
+        'Avg': summary_df['Avg']
+    }).drop_duplicates(['Normalized_Modality', 'Sequence_key'])
+
+    mapped = mapping_df.merge(tests, on=['Normalized_Modality', 'Sequence_key'], how='inner', sort=False)
+    return {
+        f"{modality}_{area}": value
+        for modality, area, value in zip(mapped['Normalized_Modality'], mapped['area'], mapped['Avg'])
+    }
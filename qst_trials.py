@@ -0,0 +1,146 @@
+"""
+Streaming ingestion of raw per-trial sheets.
+
+The device exports one row per trial alongside the summary sheet. These sheets
+can be very large, so instead of loading them with pd.read_excel the rows are
+read through a read-only openpyxl cursor and folded into running per-(Sequence,
+Modality) statistics, using constant memory per test. The result has the same
+Sequence/Modality/Trials/Avg/Var/STD layout as the summary sheet and can be
+cross-checked against it with compare_with_summary.
+"""
+
+import math
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+# Header names recognised as the per-trial threshold column, in order of preference
+TRIAL_VALUE_COLUMNS = ['Value', 'Threshold', 'Temperature', 'Temp', 'Result']
+
+
+class RunningStats:
+    """Welford's online mean and variance."""
+
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def variance(self, ddof=1):
+        if self.count - ddof <= 0:
+            return math.nan
+        return self.m2 / (self.count - ddof)
+
+
+def _find_columns(header, value_column=None):
+    header = [str(h).strip() if h is not None else '' for h in header]
+    if 'Sequence' not in header or 'Modality' not in header or 'Avg' in header:
+        return None
+
+    candidates = [value_column] if value_column else TRIAL_VALUE_COLUMNS
+    for name in candidates:
+        if name in header:
+            return header.index('Sequence'), header.index('Modality'), header.index(name)
+    return None
+
+
+def iter_trial_rows(workbook, value_column=None, sheet_names=None):
+    """
+    Yield (sequence, modality, value) for every trial row of the raw trial sheets.
+
+    A sheet counts as a trial sheet when its header has Sequence, Modality and a
+    trial value column but no Avg column (which marks the summary sheet).
+    """
+    for ws in workbook.worksheets:
+        if sheet_names is not None and ws.title not in sheet_names:
+            continue
+
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            continue
+
+        columns = _find_columns(header, value_column)
+        if columns is None:
+            continue
+
+        seq_idx, mod_idx, val_idx = columns
+        for row in rows:
+            if len(row) <= max(columns):
+                continue
+            sequence, modality, value = row[seq_idx], row[mod_idx], row[val_idx]
+            if sequence is None or not isinstance(value, (int, float)):
+                continue
+            yield sequence, modality, float(value)
+
+
+def stream_trial_stats(source, value_column=None, sheet_names=None, ddof=1):
+    """
+    Compute per-(Sequence, Modality) trial statistics from the raw trial sheets.
+
+    Parameters:
+    source - path or binary file object of an .xlsx workbook
+    value_column - header of the trial value column (default: first of TRIAL_VALUE_COLUMNS found)
+    sheet_names - restrict to these sheets (default: every sheet that looks like a trial sheet)
+    ddof - delta degrees of freedom for Var/STD
+
+    Returns:
+    DataFrame with Sequence, Modality, Trials, Avg, Var and STD columns
+    """
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        stats = {}
+        for sequence, modality, value in iter_trial_rows(workbook, value_column, sheet_names):
+            key = (sequence, modality)
+            if key not in stats:
+                stats[key] = RunningStats()
+            stats[key].update(value)
+    finally:
+        workbook.close()
+
+    records = []
+    for (sequence, modality), s in stats.items():
+        variance = s.variance(ddof)
+        records.append({
+            'Sequence': sequence,
+            'Modality': modality,
+            'Trials': s.count,
+            'Avg': s.mean,
+            'Var': variance,
+            'STD': math.sqrt(variance) if not math.isnan(variance) else math.nan
+        })
+
+    return pd.DataFrame(records, columns=['Sequence', 'Modality', 'Trials', 'Avg', 'Var', 'STD'])
+
+
+def compare_with_summary(trial_stats, summary_df, rtol=1e-3, atol=1e-2):
+    """
+    Cross-check streamed trial statistics against the device's summary sheet.
+
+    Returns:
+    DataFrame with one row per summary test: the summary and streamed Trials/Avg/STD,
+    and a 'matches' flag that is False when a value disagrees or the test has no raw trials
+    """
+    columns = [col for col in ['Sequence', 'Modality', 'Trials', 'Avg', 'STD'] if col in summary_df.columns]
+    streamed = trial_stats[['Sequence', 'Modality', 'Trials', 'Avg', 'STD']].rename(
+        columns={'Trials': 'Trials_trials', 'Avg': 'Avg_trials', 'STD': 'STD_trials'}
+    )
+    comparison = summary_df[columns].merge(streamed, on=['Sequence', 'Modality'], how='left')
+
+    matches = comparison['Avg_trials'].notna()
+    for col in ['Trials', 'Avg', 'STD']:
+        if col in columns:
+            summary = pd.to_numeric(comparison[col], errors='coerce').to_numpy(dtype=float)
+            trials = comparison[f"{col}_trials"].to_numpy(dtype=float)
+            matches &= np.isclose(summary, trials, rtol=rtol, atol=atol, equal_nan=True)
+    comparison['matches'] = matches
+    return comparison